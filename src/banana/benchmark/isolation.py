@@ -0,0 +1,226 @@
+"""Measure the runner stages, eventually isolated in a child process.
+
+Isolated stages are killed when exceeding a time or memory limit, without
+affecting the calling process.
+
+"""
+
+import cProfile
+import multiprocessing
+import sys
+import time
+import traceback
+
+
+def peak_rss():
+    """
+    Peak resident set size of the current process.
+
+    On Linux this is the high-water mark since the last
+    :func:`reset_peak_rss`, otherwise since the process started.
+
+    Returns
+    -------
+        int or None
+            peak memory (in KiB), ``None`` if not available on the current
+            platform
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource  # pylint:disable=import-outside-toplevel
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the current process to the current
+    one.
+
+    Returns
+    -------
+        bool
+            whether the reset is supported (only on Linux)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def measure(function, *args, profile=False, thread=False):
+    """Call a function, measuring it.
+
+    Returns the function result, together with wall and CPU times, and the
+    profiling statistics (``None`` if not profiled).
+    If ``thread`` is set, the CPU time is the one of the calling thread only
+    (excluding the threads started by the function), such that it is not
+    inflated by other threads running concurrently.
+
+    """
+    clock = time.thread_time if thread else time.process_time
+    profiler = cProfile.Profile() if profile else None
+    wall, cpu = time.perf_counter(), clock()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = function(*args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    wall, cpu = time.perf_counter() - wall, clock() - cpu
+    stats = None
+    if profiler is not None:
+        profiler.create_stats()
+        stats = profiler.stats
+    return result, wall, cpu, stats
+
+
+def measure_child(function, *args, profile=False):
+    """Measure a function as :func:`measure`, in a separate process.
+
+    The peak memory of the process while running the function is appended to
+    the measures.
+
+    """
+    reset = reset_peak_rss()
+    start = peak_rss()
+    measured = measure(function, *args, profile=profile)
+    peak = peak_rss()
+    if not reset and peak is not None:
+        peak -= start
+    return (*measured, peak)
+
+
+class IsolationError(RuntimeError):
+    """An isolated stage did not complete.
+
+    Parameters
+    ----------
+        stage : str or None
+            runner stage (``None`` if not known), see
+            :attr:`~banana.benchmark.runner.BenchmarkRunner.isolate`
+        reason : str
+            ``"timeout"``, ``"memory"``, ``"crash"`` or ``"exception"``
+        detail : str
+            human readable description
+        exc_type : str
+            name of the exception raised by the stage, if any
+        trace : str or None
+            formatted traceback of the exception raised by the stage, if any
+    """
+
+    def __init__(self, stage, reason, detail, exc_type="IsolationError", trace=None):
+        super().__init__(stage, reason, detail, exc_type, trace)
+        self.stage = stage
+        self.reason = reason
+        self.detail = detail
+        self.exc_type = exc_type
+        self.trace = trace
+
+    def __str__(self):
+        if self.stage is None:
+            return f"{self.reason}: {self.detail}"
+        return f"{self.stage} {self.reason}: {self.detail}"
+
+
+def resident_memory(pid):
+    """
+    Current resident set size of a process.
+
+    It is read from ``/proc``, so it is only available on Linux.
+
+    Returns
+    -------
+        int or None
+            memory (in KiB), ``None`` if not available on the current
+            platform
+    """
+    try:
+        import resource  # pylint:disable=import-outside-toplevel
+    except ImportError:
+        return None
+    try:
+        with open(f"/proc/{pid}/statm", encoding="utf-8") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
+
+
+def _target(conn, function, args, profile):
+    """Child entry point of :func:`isolated`."""
+    try:
+        conn.send(("done", measure_child(function, *args, profile=profile)))
+    except BaseException as err:  # pylint:disable=broad-except
+        conn.send(("error", (type(err).__name__, str(err), traceback.format_exc())))
+    finally:
+        conn.close()
+
+
+def isolated(stage, timeout, memory_limit, function, *args, profile=False):
+    """Call a function in a child process, measuring it as
+    :func:`measure_child`.
+
+    The child is killed as soon as it runs longer than ``timeout`` seconds, or
+    its resident memory exceeds ``memory_limit`` MiB (only the child itself is
+    watched, not the processes it eventually spawns).
+    The memory is watched through :func:`resident_memory`, so the limit is
+    only enforced on Linux, and ignored elsewhere.
+    All failures are reported as :class:`IsolationError`.
+
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_target, args=(sender, function, args, profile)
+    )
+    start = time.monotonic()
+    process.start()
+    sender.close()
+    try:
+        while not receiver.poll(0.05):
+            if not process.is_alive():
+                # it may have sent right before exiting
+                if receiver.poll():
+                    break
+                raise IsolationError(
+                    stage, "crash", f"exited with code {process.exitcode}"
+                )
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise IsolationError(stage, "timeout", f"exceeded {timeout} s")
+            rss = resident_memory(process.pid)
+            if memory_limit is not None and rss is not None:
+                if rss > memory_limit * 1024:
+                    raise IsolationError(
+                        stage,
+                        "memory",
+                        f"{rss // 1024} MiB exceeded {memory_limit} MiB",
+                    )
+        try:
+            status, payload = receiver.recv()
+        except EOFError as err:
+            raise IsolationError(stage, "crash", "exited without a result") from err
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
+    if status == "error":
+        exc_type, message, formatted = payload
+        raise IsolationError(
+            stage, "exception", f"{exc_type}: {message}", exc_type, formatted
+        )
+    return payload
@@ -0,0 +1,385 @@
+"""Queue of configurations, drained by independent workers.
+
+The queue is stored in the benchmark DB itself (see
+:class:`~banana.data.db.Job`), so workers can run in different processes or
+on different nodes sharing the filesystem.
+
+"""
+
+import hashlib
+import multiprocessing
+import pickle
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import sqlalchemy
+import sqlalchemy.exc
+import sqlalchemy.orm
+
+from ..data import db, sql
+from . import isolation
+
+
+def heartbeat(engine, uid, worker, lease, stop):
+    """Keep renewing the lease of a job, until ``stop`` is set."""
+    session = sqlalchemy.orm.sessionmaker(bind=engine)()
+    try:
+        while not stop.wait(lease / 3):
+            now = datetime.now(timezone.utc)
+            try:
+                session.query(db.Job).filter(
+                    db.Job.uid == uid, db.Job.worker == worker
+                ).update(
+                    {
+                        db.Job.lease: now + timedelta(seconds=lease),
+                        db.Job.heartbeat: now,
+                    },
+                    synchronize_session=False,
+                )
+                session.commit()
+            except sqlalchemy.exc.SQLAlchemyError:
+                # e.g. the DB is locked by another worker, the lease tolerates
+                # a missed heartbeat
+                session.rollback()
+    finally:
+        session.close()
+
+
+def config_hash(t, o, pdf_name):
+    """Hash identifying a configuration.
+
+    Parameters
+    ----------
+    t : dict
+        theory card
+    o : dict
+        o-card
+    pdf_name : str
+        applied PDF
+
+    Returns
+    -------
+    str
+        configuration hash
+
+    """
+    return hashlib.sha256(f"{t['hash']}{o['hash']}{pdf_name}".encode()).hexdigest()
+
+
+class JobQueue:
+    """Job queue methods of :class:`~banana.benchmark.runner.BenchmarkRunner`.
+
+    Jobs are configurations, computed through
+    :meth:`~banana.benchmark.runner.BenchmarkRunner.run_config`.
+
+    """
+
+    external = ""
+    """Name of the external, see
+    :attr:`~banana.benchmark.runner.BenchmarkRunner.external`"""
+
+    banana_cfg = {}
+    """Global configuration, holding the DB path"""
+
+    theory_affinity = False
+    """Whether to claim jobs of the same theory first, see
+    :attr:`~banana.benchmark.runner.BenchmarkRunner.theory_affinity`"""
+
+    max_attempts = 3
+    """Maximum number of claims of a job whose lease keeps expiring (i.e. its
+    worker dies while running it), after which the job is failed; no limit if
+    ``None``"""
+
+    def db(self, db_path):
+        """Open the DB, see :meth:`~banana.benchmark.runner.BenchmarkRunner.db`."""
+        raise NotImplementedError
+
+    def prepare_pdfs(self, pdfs):
+        """Install PDF sets, see
+        :meth:`~banana.benchmark.runner.BenchmarkRunner.prepare_pdfs`."""
+        raise NotImplementedError
+
+    def print_config(self, t, o, pdf_name):
+        """Announce a configuration, see
+        :meth:`~banana.benchmark.runner.BenchmarkRunner.print_config`."""
+        raise NotImplementedError
+
+    def store_failure(self, session, t, o, pdf_name, error):
+        """Record a failure, see
+        :meth:`~banana.benchmark.runner.BenchmarkRunner.store_failure`."""
+        raise NotImplementedError
+
+    def run_config(self, session, t, o, pdf_name, use_replicas):
+        """Run a configuration, see
+        :meth:`~banana.benchmark.runner.BenchmarkRunner.run_config`."""
+        raise NotImplementedError
+
+    def enqueue(self, session, configs, use_replicas):
+        """
+        Add configurations to the job queue.
+
+        Configurations already queued are left untouched, unless they failed,
+        in which case they are queued again.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        configs : iterable(tuple(dict, dict, str))
+            configurations to queue, i.e. theory card, o-card and PDF name
+        use_replicas: bool
+            if True use the full PDF set
+
+        Returns
+        -------
+        int
+            number of jobs (re)queued
+        """
+        records = []
+        for t, o, pdf_name in configs:
+            key = f"{config_hash(t, o, pdf_name)}{self.external}{use_replicas}"
+            records.append(
+                dict(
+                    hash=hashlib.sha256(key.encode()).hexdigest(),
+                    t_hash=t["hash"],
+                    o_hash=o["hash"],
+                    pdf=pdf_name,
+                    external=self.external,
+                    theory=pickle.dumps(t),
+                    ocard=pickle.dumps(o),
+                    use_replicas=int(use_replicas),
+                    status="pending",
+                    attempts=0,
+                )
+            )
+        if len(records) == 0:
+            return 0
+        new, _ = sql.insertnew(session, db.Job, pd.DataFrame(records))
+        requeued = (
+            session.query(db.Job)
+            .filter(
+                db.Job.hash.in_([r["hash"] for r in records]),
+                db.Job.status == "failed",
+            )
+            .update(
+                {
+                    db.Job.status: "pending",
+                    db.Job.worker: None,
+                    db.Job.lease: None,
+                    db.Job.attempts: 0,
+                },
+                synchronize_session=False,
+            )
+        )
+        session.commit()
+        return new + requeued
+
+    def claim_job(self, session, worker, lease, t_hash=None):
+        """
+        Claim the first available job of the current external.
+
+        Available jobs are the pending ones, and the running ones whose lease
+        expired (i.e. their worker stopped sending heartbeats), unless they
+        already reached :attr:`max_attempts` (see :meth:`fail_exhausted_jobs`).
+        The claim is a conditional update, so concurrent workers are never
+        claiming the same job.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        worker : str
+            worker name
+        lease : float
+            lease duration (in seconds)
+        t_hash : str or None
+            if not ``None``, prefer jobs of this theory
+
+        Returns
+        -------
+        db.Job or None
+            claimed job, ``None`` if none is available
+        """
+        self.fail_exhausted_jobs(session)
+        while True:
+            now = datetime.now(timezone.utc)
+            expired = sqlalchemy.and_(db.Job.status == "running", db.Job.lease < now)
+            if self.max_attempts is not None:
+                expired = sqlalchemy.and_(expired, db.Job.attempts < self.max_attempts)
+            available = sqlalchemy.and_(
+                db.Job.external == self.external,
+                sqlalchemy.or_(db.Job.status == "pending", expired),
+            )
+            order = [db.Job.uid]
+            if t_hash is not None:
+                order.insert(0, (db.Job.t_hash == t_hash).desc())
+            candidate = (
+                session.query(db.Job.uid).filter(available).order_by(*order).first()
+            )
+            if candidate is None:
+                return None
+            claimed = (
+                session.query(db.Job)
+                .filter(db.Job.uid == candidate[0], available)
+                .update(
+                    {
+                        db.Job.status: "running",
+                        db.Job.worker: worker,
+                        db.Job.lease: now + timedelta(seconds=lease),
+                        db.Job.heartbeat: now,
+                        db.Job.attempts: db.Job.attempts + 1,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            session.commit()
+            if claimed == 1:
+                return session.query(db.Job).filter(db.Job.uid == candidate[0]).one()
+            # somebody else was faster, try the next one
+
+    def fail_exhausted_jobs(self, session):
+        """
+        Fail the jobs whose lease expired, and reached :attr:`max_attempts`.
+
+        Their worker died on every attempt, so they are most likely killing
+        the worker themselves: a failure is recorded, with reason
+        ``"crash"``.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+
+        Returns
+        -------
+        int
+            number of jobs failed
+        """
+        if self.max_attempts is None:
+            return 0
+        now = datetime.now(timezone.utc)
+        exhausted = sqlalchemy.and_(
+            db.Job.external == self.external,
+            db.Job.status == "running",
+            db.Job.lease < now,
+            db.Job.attempts >= self.max_attempts,
+        )
+        failed = 0
+        for job in session.query(db.Job).filter(exhausted).all():
+            # the update is conditional, so the failure is recorded only once
+            updated = (
+                session.query(db.Job)
+                .filter(db.Job.uid == job.uid, exhausted)
+                .update(
+                    {db.Job.status: "failed", db.Job.lease: None},
+                    synchronize_session=False,
+                )
+            )
+            session.commit()
+            if updated == 0:
+                continue
+            error = isolation.IsolationError(
+                None,
+                "crash",
+                f"worker lost {job.attempts} times, last one: {job.worker}",
+            )
+            self.store_failure(
+                session,
+                pickle.loads(job.theory),
+                pickle.loads(job.ocard),
+                job.pdf,
+                error,
+            )
+            failed += 1
+        return failed
+
+    def work(self, worker=None, lease=60.0, poll=None):
+        """
+        Run queued jobs, until the queue is drained.
+
+        Any number of workers can run at the same time, on the same DB, e.g.
+        in different processes or on different nodes sharing the filesystem.
+        While running a job, the lease is renewed every third of its duration,
+        so jobs of dead workers are claimed again after at most ``lease``
+        seconds.
+        If :attr:`theory_affinity` is set, jobs of the same theory of the last
+        one are claimed first.
+
+        Parameters
+        ----------
+            worker : str or None
+                worker name, if ``None`` host name and process id are used
+            lease : float
+                lease duration (in seconds), it should be long enough to
+                tolerate a missed heartbeat
+            poll : float or None
+                if not ``None``, when no job is available but some are still
+                running, wait this amount of seconds and retry, in order to
+                take over the jobs of dead workers; otherwise stop immediately
+
+        Returns
+        -------
+            int
+                number of jobs completed successfully
+        """
+        if worker is None:
+            worker = f"{socket.gethostname()}:{multiprocessing.current_process().pid}"
+        session = self.db(self.banana_cfg["paths"]["database"])
+        queued = session.query(db.Job.pdf).filter(
+            db.Job.external == self.external, db.Job.status != "done"
+        )
+        self.prepare_pdfs(sorted({pdf for pdf, in queued.distinct()}))
+        done = 0
+        t_hash = None
+        while True:
+            job = self.claim_job(session, worker, lease, t_hash)
+            if job is None:
+                running = (
+                    session.query(db.Job)
+                    .filter(
+                        db.Job.external == self.external, db.Job.status == "running"
+                    )
+                    .count()
+                )
+                if poll is None or running == 0:
+                    return done
+                time.sleep(poll)
+                continue
+            t, o = pickle.loads(job.theory), pickle.loads(job.ocard)
+            if self.theory_affinity:
+                t_hash = job.t_hash
+            self.print_config(t, o, job.pdf)
+            stop = threading.Event()
+            beat = threading.Thread(
+                target=heartbeat,
+                args=(session.bind, job.uid, worker, lease, stop),
+                daemon=True,
+            )
+            beat.start()
+            # if interrupted, give the job back
+            status = "pending"
+            try:
+                if self.run_config(session, t, o, job.pdf, bool(job.use_replicas)):
+                    status = "done"
+                else:
+                    status = "failed"
+            except Exception:
+                status = "failed"
+                raise
+            finally:
+                stop.set()
+                beat.join()
+                session.rollback()
+                # unless it has been taken over, after the lease expired
+                session.query(db.Job).filter(
+                    db.Job.uid == job.uid, db.Job.worker == worker
+                ).update(
+                    {db.Job.status: status, db.Job.lease: None},
+                    synchronize_session=False,
+                )
+                session.commit()
+            if status == "done":
+                done += 1
@@ -1,11 +1,21 @@
 import abc
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import hashlib
+import heapq
 import itertools
 import pathlib
 import pickle
+import shutil
 import subprocess
+import tarfile
+import time
+import traceback
 from collections.abc import Iterable
 
+import pendulum
 import rich
 import rich.box
 import rich.markdown
@@ -16,11 +26,38 @@ import sqlalchemy.orm
 
 from .. import cfg, toy
 from ..data import db, dfdict, sql, theories
+from . import isolation
+from .queue import JobQueue, config_hash
 
+pdf_cache = collections.OrderedDict()
+"""Loaded PDF objects, with their size, from the least to the most recently
+used"""
 
-def get_pdf(pdf_name, full_set=False):
+pdf_cache_budget = 500
+"""Maximum number of PDF members to keep loaded in :data:`pdf_cache`"""
+
+
+@functools.lru_cache(maxsize=None)
+def available_pdf_sets():
+    """
+    List the installed LHAPDF sets.
+
+    The list is cached, call ``available_pdf_sets.cache_clear()`` to refresh
+    it.
+
+    Returns
+    -------
+        set(str)
+            installed sets
+    """
+    import lhapdf  # pylint:disable=import-outside-toplevel,import-error
+
+    return set(lhapdf.availablePDFSets())
+
+
+def load_pdf(pdf_name, full_set=False, member=0):
     """
-    Load PDF object from either LHAPDF or :mod:`toyLH`
+    Load PDF object from either LHAPDF or :mod:`toyLH`, bypassing the cache
 
     Parameters
     ----------
@@ -28,6 +65,8 @@ def get_pdf(pdf_name, full_set=False):
             pdf name
         full_set: bool
             if True, return the full PDFs set with all the replicas
+        member: int
+            member to load, if not loading the full set
 
     Returns
     -------
@@ -36,25 +75,109 @@ def get_pdf(pdf_name, full_set=False):
     """
     # setup PDFset
     if pdf_name in ["ToyLH_polarized", "ToyLH"]:
-        pdf = toy.mkPDF(pdf_name, 0)
+        pdf = toy.mkPDF(pdf_name, member)
         if full_set:
             pdf = [pdf]
     else:
         import lhapdf  # pylint:disable=import-outside-toplevel,import-error
 
         # is the set installed? if not do it now
-        if pdf_name not in lhapdf.availablePDFSets():
+        if pdf_name not in available_pdf_sets():
             print(f"PDFSet {pdf_name} is not installed! Installing now via lhapdf ...")
-            res = subprocess.run(
-                ["lhapdf", "get", pdf_name], check=True, capture_output=True
-            )
-            if len(res.stdout) == 0:
-                raise ValueError("lhapdf could not install the set!")
+            install_pdf(pdf_name)
             print(f"{pdf_name} installed.")
+            available_pdf_sets.cache_clear()
         if full_set:
             pdf = lhapdf.mkPDFs(pdf_name)
         else:
-            pdf = lhapdf.mkPDF(pdf_name, 0)
+            pdf = lhapdf.mkPDF(pdf_name, member)
+    return pdf
+
+
+def install_pdf(pdf_name, mirror=None):
+    """
+    Install a LHAPDF set.
+
+    Parameters
+    ----------
+        pdf_name : str
+            pdf name
+        mirror : os.PathLike or None
+            local directory containing the sets, either unpacked or as
+            ``<pdf_name>.tar.gz`` archives; if ``None``, or the set is not
+            there, it is downloaded with ``lhapdf get``
+
+    Raises
+    ------
+        ValueError
+            if an archive in the mirror contains anything outside of the
+            ``<pdf_name>/`` folder
+    """
+    import lhapdf  # pylint:disable=import-outside-toplevel,import-error
+
+    if mirror is not None:
+        source = pathlib.Path(mirror) / pdf_name
+        target = pathlib.Path(lhapdf.paths()[0])
+        if source.is_dir():
+            shutil.copytree(source, target / pdf_name, dirs_exist_ok=True)
+            return
+        archive = source.with_name(f"{pdf_name}.tar.gz")
+        if archive.is_file():
+            with tarfile.open(archive) as tar:
+                for member in tar.getmembers():
+                    parts = pathlib.PurePosixPath(member.name).parts
+                    if parts[:1] != (pdf_name,) or ".." in parts:
+                        raise ValueError(
+                            f"{archive} contains '{member.name}', outside of"
+                            f" '{pdf_name}/'"
+                        )
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(target, filter="data")
+                else:
+                    # no links support, without the safety filters
+                    tar.extractall(
+                        target,
+                        [m for m in tar.getmembers() if m.isfile() or m.isdir()],
+                    )
+            return
+    res = subprocess.run(["lhapdf", "get", pdf_name], check=True, capture_output=True)
+    if len(res.stdout) == 0:
+        raise ValueError("lhapdf could not install the set!")
+
+
+def get_pdf(pdf_name, full_set=False, member=0):
+    """
+    Get PDF object, loading it only if not already in :data:`pdf_cache`
+
+    The least recently used objects are evicted from the cache, as soon as more
+    than :data:`pdf_cache_budget` members are loaded.
+
+    Parameters
+    ----------
+        pdf_name : str
+            pdf name
+        full_set: bool
+            if True, return the full PDFs set with all the replicas
+        member: int
+            member to load, if not loading the full set
+
+    Returns
+    -------
+        pdf : lhapdf_like
+            PDF object
+    """
+    key = (pdf_name, full_set, 0 if full_set else member)
+    if key in pdf_cache:
+        pdf_cache.move_to_end(key)
+        return pdf_cache[key][0]
+    pdf = load_pdf(pdf_name, full_set, member)
+    pdf_cache[key] = (pdf, len(pdf) if full_set else 1)
+    # evict, but always keep the last one
+    while (
+        sum(size for _, size in pdf_cache.values()) > pdf_cache_budget
+        and len(pdf_cache) > 1
+    ):
+        pdf_cache.popitem(last=False)
     return pdf
 
 
@@ -77,6 +200,221 @@ def pdf_name(pdf):
     return pdf.set().name
 
 
+def projected_hash(card, fields):
+    """Hash of a card, only considering some of its fields.
+
+    Parameters
+    ----------
+    card : dict
+        theory card or o-card
+    fields : list(str) or None
+        relevant fields, if ``None`` the full card hash is returned
+
+    Returns
+    -------
+    str
+        card hash
+
+    """
+    if fields is None:
+        return card["hash"]
+    projection = {field: card[field] for field in fields}
+    # keep field names, otherwise projections on equal values would collide
+    pairs = tuple(zip(sorted(projection), sql.serialize(projection)))
+    return sql.add_hash(pairs)[-1]
+
+
+def total_wall():
+    """SQL expression of the total wall time recorded in
+    :class:`~banana.data.db.Metrics`."""
+    return sum(getattr(db.Metrics, f"{stage}_wall") for stage in db.stages)
+
+
+def log_document(log_record):
+    """Convert a log to its raw document.
+
+    Parameters
+    ----------
+    log_record : DFdict or dict(DFdict)
+        log, as returned by :meth:`BenchmarkRunner.log`
+
+    Returns
+    -------
+    dict
+        raw document, suitable for pickling
+
+    """
+    # TODO: quickfix for different eko/yadism format
+    if isinstance(log_record, dfdict.DFdict):
+        return log_record.to_document()
+    return dict(map(lambda t: (t[0], t[1].to_document()), log_record.items()))
+
+
+def log_from_document(document):
+    """Load a log back from its raw document.
+
+    Inverse of :func:`log_document`.
+
+    Parameters
+    ----------
+    document : dict
+        raw document
+
+    Returns
+    -------
+    DFdict or dict(DFdict)
+        log
+
+    """
+    if "__msgs__" in document:
+        return dfdict.DFdict.from_document(document)
+    return {k: dfdict.DFdict.from_document(v) for k, v in document.items()}
+
+
+def _compute_configs(runner, t, os, pdf_name, use_replicas, exts):
+    """Worker entry point for :meth:`BenchmarkRunner.compute_configs`.
+
+    The logs are shipped back as raw documents, since a non-empty
+    :class:`DFdict` can not be unpickled.
+
+    """
+    outcomes = runner.retrying(
+        runner.compute_configs, t, os, pdf_name, use_replicas, exts
+    )
+    return [
+        (new_ext, log_document(log_record), metrics, profiles)
+        for new_ext, log_record, metrics, profiles in outcomes
+    ]
+
+
+def _run_external_replica(runner, t, o, pdf_name, n_rep):
+    """Worker entry point to run the external on a single replica.
+
+    PDF objects can not be pickled, so the replica is loaded by the worker.
+
+    """
+    return runner.run_external(t, o, get_pdf(pdf_name, member=n_rep))
+
+
+class Stopwatch:
+    """Accumulate wall and CPU times spent in runner stages."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, stage, wall, cpu):
+        """
+        Add time to a stage.
+
+        Parameters
+        ----------
+            stage : str
+                stage name, see :data:`banana.data.db.stages`
+            wall : float
+                wall time (in seconds)
+            cpu : float
+                CPU time (in seconds)
+        """
+        for kind, value in (("wall", wall), ("cpu", cpu)):
+            key = f"{stage}_{kind}"
+            self.metrics[key] = self.metrics.get(key, 0.0) + value
+
+
+class RunStatus:
+    """Progress of a run, shown on a single progress bar.
+
+    Parameters
+    ----------
+        console : rich.console.Console
+            output console
+        total : int
+            number of configurations to run
+        show_bar : bool
+            if False only keep count, without displaying the bar
+    """
+
+    def __init__(self, console, total, show_bar=True):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.hits = 0
+        self.misses = 0
+        self.start = time.perf_counter()
+        self.bar = rich.progress.Progress(
+            rich.progress.TextColumn("[progress.description]{task.description}"),
+            rich.progress.BarColumn(),
+            rich.progress.MofNCompleteColumn(),
+            rich.progress.TextColumn("{task.fields[stats]}"),
+            rich.progress.TimeRemainingColumn(),
+            console=console,
+            disable=not show_bar,
+        )
+        self.task = self.bar.add_task("Running", total=total, stats="")
+
+    def __enter__(self):
+        self.bar.start()
+        return self
+
+    def __exit__(self, *_exc):
+        self.bar.stop()
+
+    @property
+    def elapsed(self):
+        """Time since the beginning of the run (in seconds)."""
+        return time.perf_counter() - self.start
+
+    @property
+    def throughput(self):
+        """Configurations completed per second."""
+        return self.done / self.elapsed
+
+    def stats(self):
+        """Throughput and cache hit rate."""
+        hit_rate = self.hits / max(self.hits + self.misses, 1)
+        return f"{self.throughput:.2f} cfg/s, cached {hit_rate:.0%}"
+
+    def cached(self, hit):
+        """Count a cache hit or miss."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def advance(self, failed=False):
+        """Count a completed (or failed) configuration."""
+        self.done += 1
+        if failed:
+            self.failed += 1
+        self.bar.update(self.task, advance=1, stats=self.stats())
+
+    def summary(self):
+        """Compact report of the run."""
+        return (
+            f"Completed: {self.done}/{self.total} in {self.elapsed:.1f} s\n"
+            + f"Cached: {self.hits} Computed: {self.misses} Failed: {self.failed}\n"
+            + f"Throughput: {self.throughput:.2f} cfg/s"
+        )
+
+
+def _compute_external(runner, t, os, pdf_name, use_replicas):
+    """Worker entry point for :meth:`BenchmarkRunner.compute_external_batch`."""
+    pdf = get_pdf(pdf_name, full_set=use_replicas)
+    return runner.compute_external_batch(t, os, pdf)
+
+
+def _run_me(runner, t, os, pdf_name, use_replicas):
+    """Isolated entry point for :meth:`BenchmarkRunner.run_me_batch`."""
+    return runner.run_me_batch(t, os, get_pdf(pdf_name, full_set=use_replicas))
+
+
 default_cache = {"t_hash": b"", "o_hash": b"", "pdf": "", "external": "", "result": b""}
 default_cache = dict(sorted(default_cache.items()))
 
@@ -85,7 +423,7 @@ default_log = {"t_hash": b"", "o_hash": b"", "pdf": "", "external": "", "log": b
 default_log = dict(sorted(default_log.items()))
 
 
-class BenchmarkRunner:
+class BenchmarkRunner(JobQueue):
     banana_cfg = {}
     """Global configuration"""
 
@@ -97,9 +435,151 @@ class BenchmarkRunner:
     db_base_cls = None
     """Base class that describes db schema"""
 
+    replica_workers = 1
+    """Number of processes running the external on the PDF replicas"""
+
+    replica_pool = None
+    """Processes running the external on the PDF replicas, for the current
+    run (so that their PDF sets stay loaded)"""
+
+    cache_index = None
+    """Cache entries available for the current run, see
+    :meth:`prefetch_external`"""
+
+    commit_every = 1
+    """Maximum number of new cache and log records to collect, before
+    committing them in a single transaction"""
+
+    commit_interval = None
+    """Maximum delay (in seconds) before committing new cache and log records,
+    if ``None`` only :attr:`commit_every` is considered; records are also
+    committed before computing a configuration whose recorded cost would make
+    them overdue"""
+
+    writer = None
+    """Buffer of the records to be committed, for the current run"""
+
+    profile_stages = []
+    """Stages to profile, among ``"me"`` (:meth:`run_me`) and ``"ext"``
+    (:meth:`compute_external`), see :meth:`profile_threshold`"""
+
+    profile_hashes = []
+    """Theory or o-card hash prefixes of the configurations to profile"""
+
+    profile_rate = 0.0
+    """Fraction of configurations to profile, sampled deterministically"""
+
+    profile_duration = None
+    """If not ``None``, profile all configurations, but only keep the profiles
+    of the stages lasting longer than this (in seconds)"""
+
+    shard_history = None
+    """Path to a database providing the historical costs, used to balance
+    shards; it has to be the same for all the shards (and not being written by
+    them), otherwise the shards are not a partition"""
+
+    concurrent_external = None
+    """Run the external concurrently with our program, either on a
+    ``"thread"`` (only useful if the external is releasing the GIL, e.g.
+    compiled libraries or subprocesses; the CPU time of each stage is then
+    the one of its own thread) or in a ``"process"``; if ``None``
+    they are run one after the other; when both stages are profiled, a
+    ``"process"`` is always used"""
+
+    output = "full"
+    """Console output of a run: ``"full"`` announces every configuration and
+    renders its log, ``"progress"`` only shows a progress bar, and ``"quiet"``
+    nothing at all; a summary is printed at the end in any case"""
+
+    status = None
+    """Progress of the current run"""
+
+    isolate = []
+    """Stages to run in a child process, among ``"me"`` (:meth:`run_me`) and
+    ``"ext"`` (:meth:`compute_external`); the child is killed when exceeding
+    :attr:`timeout` or :attr:`memory_limit`, and the failure is recorded in
+    :class:`banana.data.db.Failure`, skipping the configuration"""
+
+    timeout = None
+    """Wall time limit (in seconds) of an isolated stage, no limit if ``None``"""
+
+    memory_limit = None
+    """Resident memory limit (in MiB) of an isolated stage, no limit if
+    ``None``; only enforced on Linux, see
+    :func:`~banana.benchmark.isolation.resident_memory`"""
+
+    continue_on_error = False
+    """If True, record the failure of a configuration and move on to the next
+    one, otherwise the failure is recorded and the run stopped (failures of
+    :attr:`isolate` stages are always skipped)"""
+
+    retries = 0
+    """Further attempts of a failing configuration, before giving up"""
+
+    retry_backoff = 1.0
+    """Delay (in seconds) before the first retry, doubled for each further
+    one"""
+
+    retry_errors = (Exception,)
+    """Exception types considered transient, and thus retried; isolated stages
+    exceeding :attr:`timeout` or :attr:`memory_limit` are excluded anyway, see
+    :meth:`is_transient`"""
+
+    pdf_mirror = None
+    """Local directory to install missing PDF sets from, see
+    :func:`install_pdf`"""
+
+    pdf_install_workers = 4
+    """Number of PDF sets installed at the same time"""
+
+    external_theory_fields = None
+    """Theory fields the external depends on, if ``None`` all of them; cache
+    entries are shared among theories differing only in other fields (see
+    :meth:`cache_key`)"""
+
+    external_ocard_fields = None
+    """O-card fields the external depends on, if ``None`` all of them"""
+
+    theory_affinity = False
+    """Keep the configurations of a theory together: on the same worker
+    process (see :meth:`pin_groups`), in the same shard (see
+    :meth:`shard_configurations`), and preferably on the same queue worker
+    (see :meth:`work`); this helps externals expensive to initialize for a
+    new theory"""
+
     def __init__(self):
         self.banana_cfg = cfg.cfg
 
+    def __getstate__(self):
+        # run local state is not shipped to workers
+        state = self.__dict__.copy()
+        state.pop("cache_index", None)
+        state.pop("writer", None)
+        state.pop("status", None)
+        state.pop("replica_pool", None)
+        return state
+
+    def get_writer(self, session):
+        """
+        Get the buffer for new records.
+
+        During a run, records are committed according to :attr:`commit_every`
+        and :attr:`commit_interval`, otherwise they are committed immediately.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+
+        Returns
+        -------
+        sql.WriteBehind
+            records buffer
+        """
+        if self.writer is None:
+            return sql.WriteBehind(session)
+        return self.writer
+
     @staticmethod
     @abc.abstractmethod
     def load_ocards(session, ocard_updates):
@@ -119,6 +599,29 @@ class BenchmarkRunner:
                 all requested o-cards
         """
 
+    def prepare_ocards(self, ocard_updates):
+        """
+        Generate o-cards, without storing them in the DB (see :meth:`plan`).
+
+        By default, :meth:`load_ocards` is called on a scratch in-memory DB;
+        override it if the o-cards can be generated directly.
+
+        Parameters
+        ----------
+            ocard_updates : list(dict)
+                o-card configurations
+
+        Returns
+        -------
+            ocards : list(dict)
+                all requested o-cards
+        """
+        session = self.scratch_db()
+        try:
+            return self.load_ocards(session, ocard_updates)
+        finally:
+            session.close()
+
     @abc.abstractmethod
     def run_me(self, theory, ocard, pdf):
         """
@@ -159,6 +662,69 @@ class BenchmarkRunner:
                 external result
         """
 
+    def run_me_batch(self, theory, ocards, pdf):
+        """
+        Execute our program on several o-cards, sharing the same theory.
+
+        Override it to amortize the theory setup over the o-cards, by default
+        it is calling :meth:`run_me` on each of them.
+
+        Parameters
+        ----------
+            theory : dict
+                theory card
+            ocards : list(dict)
+                o cards
+            pdf : lhapdf_like
+                PDF
+
+        Returns
+        -------
+            list(dict)
+                our results, one for each o-card
+        """
+        return [self.run_me(theory, ocard, pdf) for ocard in ocards]
+
+    def run_external_batch(self, theory, ocards, pdf):
+        """
+        Execute external program on several o-cards, sharing the same theory.
+
+        Override it to amortize the theory setup over the o-cards, by default
+        it is calling :meth:`run_external` on each of them.
+
+        Parameters
+        ----------
+            theory : dict
+                theory card
+            ocards : list(dict)
+                o cards
+            pdf : lhapdf_like
+                PDF
+
+        Returns
+        -------
+            list(dict)
+                external results, one for each o-card
+        """
+        return [self.run_external(theory, ocard, pdf) for ocard in ocards]
+
+    def batched(self):
+        """
+        Whether configurations are grouped by theory and PDF, i.e. if any
+        among :meth:`run_me_batch` and :meth:`run_external_batch` is
+        overridden.
+
+        Returns
+        -------
+            bool
+                batching status
+        """
+        cls = type(self)
+        return (
+            cls.run_me_batch is not BenchmarkRunner.run_me_batch
+            or cls.run_external_batch is not BenchmarkRunner.run_external_batch
+        )
+
     @abc.abstractmethod
     def log(self, theory, ocard, pdf, me, ext):
         """
@@ -198,14 +764,26 @@ class BenchmarkRunner:
                 db session
         """
         engine = db.engine(db_path)
-        # create the database if not existing
-        if not pathlib.Path(db_path).exists():
-            db.create_db(self.db_base_cls, engine)
+        # create the database if not existing, and any missing table
+        db.create_db(self.db_base_cls, engine)
         # make a session to the db and return it
         self.db_base_cls.metadata.bind = engine
         session = sqlalchemy.orm.sessionmaker(bind=engine)()
         return session
 
+    def scratch_db(self):
+        """
+        Create an empty in-memory database, with the current schema.
+
+        Returns
+        -------
+            session : sqlalchemy.orm.session.Session
+                db session
+        """
+        engine = db.engine()
+        db.create_db(self.db_base_cls, engine)
+        return sqlalchemy.orm.sessionmaker(bind=engine)()
+
     def load_external(self, session, t, o, pdf_name):
         """
         Look into the DB.
@@ -226,28 +804,27 @@ class BenchmarkRunner:
             ext : dict
                 external result if available
         """
+        t_key, o_key, _ = self.cache_key(t, o, pdf_name)
         ext = session.query(db.Cache).filter(
-            db.Cache.t_hash == t["hash"],
-            db.Cache.o_hash == o["hash"],
+            db.Cache.t_hash == t_key,
+            db.Cache.o_hash == o_key,
             db.Cache.pdf == pdf_name,
             db.Cache.external == self.external,
         )
         # if not found or multiple found, ext.one() will raise an Error
         return pickle.loads(ext.one().result)
 
-    def insert_external(self, session, t, o, pdf):
+    def compute_external(self, t, o, pdf):
         """
-        Obtain an external run.
+        Execute external program, over all the replicas if needed.
 
         Parameters
         ----------
-        session : sqlalchemy.orm.session.Session
-            DB ORM session
         t : dict
             theory card
         o : dict
             o-card
-        pdf : str
+        pdf : lhapdf_like or list(lhapdf_like)
             applied PDF
 
         Returns
@@ -255,122 +832,1038 @@ class BenchmarkRunner:
         ext : dict
             result
         """
-        # obtain data
         if isinstance(pdf, Iterable):
+            if self.replica_workers > 1:
+                return self.compute_external_replicas(t, o, pdf)
             ext = {}
             for n_rep, replica in enumerate(pdf):
                 ext[n_rep] = self.run_external(t, o, replica)
         else:
             ext = self.run_external(t, o, pdf)
-        record = {
-            "t_hash": t["hash"],
-            "o_hash": o["hash"],
-            "pdf": pdf_name(pdf),
-            "external": self.external,
-            # TODO: pay attention, the hash will be computed on the binarized
-            "result": pickle.dumps(ext),
-        }
-        # create record
-        new_cache = db.Cache(
-            **record, hash=hashlib.sha256(pickle.dumps(record)).digest().hex()
-        )
-        session.add(new_cache)
-        # TODO: do we want to commit here or somewhere else?
-        session.commit()
         return ext
 
-    def run_config(self, session, t, o, pdf_name, use_replicas):
+    def compute_external_batch(self, t, os, pdf):
         """
-        Run a single configuration.
+        Execute external program on several o-cards, over all the replicas if
+        needed.
 
         Parameters
         ----------
-        session : sqlalchemy.orm.session.Session
-            DB ORM session
         t : dict
             theory card
-        o : dict
-            o-card
-        pdf_name : str
+        os : list(dict)
+            o-cards
+        pdf : lhapdf_like or list(lhapdf_like)
             applied PDF
-        use_replicas: bool
-            if True use the full PDF set
+
+        Returns
+        -------
+        list(dict)
+            results, one for each o-card
         """
-        pdf = get_pdf(pdf_name, full_set=use_replicas)
-        # get our result
-        me = self.run_me(t, o, pdf)
-        # get external from cache if possible
-        try:
-            ext = self.load_external(session, t, o, pdf_name)
-            self.console.print("Cache contains the external result")
-        except sqlalchemy.orm.exc.NoResultFound:
-            self.console.print("Compute external result")
-            ext = self.insert_external(session, t, o, pdf)
-        # create log
-        log_record = self.insert_log(session, t, o, pdf, me, ext)
-        log_record.fancy()
+        if type(self).run_external_batch is BenchmarkRunner.run_external_batch:
+            return [self.compute_external(t, o, pdf) for o in os]
+        if isinstance(pdf, Iterable):
+            replicas = [self.run_external_batch(t, os, replica) for replica in pdf]
+            return [
+                {n_rep: exts[k] for n_rep, exts in enumerate(replicas)}
+                for k in range(len(os))
+            ]
+        return self.run_external_batch(t, os, pdf)
 
-    def insert_log(self, session, t, o, pdf, me, ext):
+    def compute_external_replicas(self, t, o, pdf):
         """
-        Obtain an external run.
+        Execute external program on the replicas, with a pool of processes.
+
+        The results are collected in replica order, so the outcome is the same
+        of a serial evaluation.
+        During a run the processes of :attr:`replica_pool` are reused,
+        otherwise a pool is started for this configuration only.
 
         Parameters
         ----------
-        session : sqlalchemy.orm.session.Session
-            DB ORM session
         t : dict
             theory card
         o : dict
             o-card
-        pdf_name : str
-            applied PDF
-        me : dict
-            our result
-        ext : str
+        pdf : list(lhapdf_like)
+            applied PDF set
+
+        Returns
+        -------
+        ext : dict
+            result, for each replica
+        """
+        n_reps = len(pdf)
+        with contextlib.ExitStack() as stack:
+            pool = self.replica_pool
+            if pool is None:
+                pool = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(
+                        max_workers=min(self.replica_workers, n_reps)
+                    )
+                )
+            results = pool.map(
+                _run_external_replica,
+                itertools.repeat(self, n_reps),
+                itertools.repeat(t, n_reps),
+                itertools.repeat(o, n_reps),
+                itertools.repeat(pdf_name(pdf), n_reps),
+                range(n_reps),
+            )
+            return dict(enumerate(results))
+
+    def store_external(self, session, t, o, pdf_name, ext):
+        """
+        Save an external result in the cache.
+
+        If an equivalent result is already present (e.g. computed by a
+        concurrent configuration), the cache is left untouched.
+        The record might be buffered, see :meth:`get_writer`.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        ext : dict
             external result
 
         Returns
         -------
-        log_record : dict
-            result
+        str
+            cache record hash
+        """
+        key = self.cache_key(t, o, pdf_name)
+        record = {
+            "t_hash": key[0],
+            "o_hash": key[1],
+            "pdf": pdf_name,
+            "external": self.external,
+            # TODO: pay attention, the hash will be computed on the binarized
+            "result": pickle.dumps(ext),
+        }
+        record["hash"] = hashlib.sha256(pickle.dumps(record)).digest().hex()
+
+        def on_commit(new_cache):
+            if self.cache_index is not None:
+                self.cache_index[key] = new_cache.uid
+
+        self.get_writer(session).add(db.Cache, record, on_commit=on_commit)
+        return record["hash"]
+
+    def insert_external(self, session, t, o, pdf):
+        """
+        Obtain an external run.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf : str
+            applied PDF
+
+        Returns
+        -------
+        ext : dict
+            result
+        """
+        ext = self.compute_external(t, o, pdf)
+        self.store_external(session, t, o, pdf_name(pdf), ext)
+        return ext
+
+    def cache_key(self, t, o, pdf_name):
+        """
+        Identify the external result of a configuration.
+
+        Only the fields in :attr:`external_theory_fields` and
+        :attr:`external_ocard_fields` are considered, so the cache entries
+        ``t_hash`` and ``o_hash`` are the projected hashes (see
+        :func:`projected_hash`).
+
+        Parameters
+        ----------
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+
+        Returns
+        -------
+        tuple(str, str, str)
+            projected theory hash, projected o-card hash and PDF name
+        """
+        return (
+            projected_hash(t, self.external_theory_fields),
+            projected_hash(o, self.external_ocard_fields),
+            pdf_name,
+        )
+
+    def cached_external(self, session, t, o, pdf_name):
+        """
+        Look for the external result in the cache.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+
+        Returns
+        -------
+        ext : dict or None
+            external result, or ``None`` if not available
+        """
+        if self.cache_index is None:
+            try:
+                return self.load_external(session, t, o, pdf_name)
+            except sqlalchemy.orm.exc.NoResultFound:
+                return None
+        key = self.cache_key(t, o, pdf_name)
+        if key not in self.cache_index and self.writer is not None:
+            # the result might still be pending
+            pending = self.writer.pending_records(db.Cache)
+            if any((r["t_hash"], r["o_hash"], r["pdf"]) == key for r in pending):
+                self.writer.flush()
+        uid = self.cache_index.get(key)
+        if uid is None:
+            return None
+        # the result is only loaded (and unpickled) when needed
+        result = session.query(db.Cache.result).filter(db.Cache.uid == uid).scalar()
+        return pickle.loads(result)
+
+    def logged_configs(self, session, ts, os, pdfs):
+        """
+        Collect all the configurations of a run already logged, in a single
+        query.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        ts : list(dict)
+            theory cards
+        os : list(dict)
+            o-cards
+        pdfs : list(str)
+            applied PDFs
+
+        Returns
+        -------
+        set(tuple(str, str, str))
+            theory hash, o-card hash and PDF name of logged configurations
+        """
+        return self.recorded_configs(session, db.Log, ts, os, pdfs)
+
+    def failed_configs(self, session, ts, os, pdfs):
+        """
+        Collect all the configurations of a run that failed, and have not
+        been logged since.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        ts : list(dict)
+            theory cards
+        os : list(dict)
+            o-cards
+        pdfs : list(str)
+            applied PDFs
+
+        Returns
+        -------
+        set(tuple(str, str, str))
+            theory hash, o-card hash and PDF name of failed configurations
+        """
+        failed = self.recorded_configs(session, db.Failure, ts, os, pdfs)
+        return failed - self.logged_configs(session, ts, os, pdfs)
+
+    def recorded_configs(self, session, table, ts, os, pdfs, chunk_size=400):
+        """
+        Collect all the configurations of a run recorded in a table, in as few
+        queries as possible.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        table : sqlalchemy.ext.declarative.api.DeclarativeMeta
+            table object, with :class:`banana.data.db.CalcResult` columns
+        ts : list(dict)
+            theory cards
+        os : list(dict)
+            o-cards
+        pdfs : list(str)
+            applied PDFs
+        chunk_size : int
+            number of theory and o-card hashes (each) looked up at once
+
+        Returns
+        -------
+        set(tuple(str, str, str))
+            theory hash, o-card hash and PDF name of recorded configurations
+        """
+        if not self.has_table(session, table):
+            return set()
+        t_hashes = sorted({t["hash"] for t in ts})
+        o_hashes = sorted({o["hash"] for o in os})
+        recorded = set()
+        for t_chunk, o_chunk in itertools.product(
+            sql.chunks(t_hashes, chunk_size), sql.chunks(o_hashes, chunk_size)
+        ):
+            keys = session.query(table.t_hash, table.o_hash, table.pdf).filter(
+                table.external == self.external,
+                table.pdf.in_(set(pdfs)),
+                table.t_hash.in_(t_chunk),
+                table.o_hash.in_(o_chunk),
+            )
+            recorded.update(tuple(key) for key in keys)
+        return recorded
+
+    @staticmethod
+    def has_table(session, table):
+        """
+        Check whether a table is present in the DB.
+
+        Tables might be missing in DBs not migrated yet, see :meth:`plan`.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        table : sqlalchemy.ext.declarative.api.DeclarativeMeta
+            table object
+
+        Returns
+        -------
+        bool
+            whether the table is present
+        """
+        return sqlalchemy.inspect(session.bind).has_table(table.__tablename__)
+
+    def prefetch_external(self, session, ts, os, pdfs, chunk_size=400):
+        """
+        Collect all the cache entries relevant for a run, in as few queries as
+        possible.
+
+        Only the keys are loaded, while results are left in the DB.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        ts : list(dict)
+            theory cards
+        os : list(dict)
+            o-cards
+        pdfs : list(str)
+            applied PDFs
+        chunk_size : int
+            number of theory and o-card hashes (each) looked up at once
+
+        Returns
+        -------
+        index : dict
+            cache entries ``uid``, indexed by :meth:`cache_key` (if multiple
+            are available, the latest is kept)
+        """
+        if not self.has_table(session, db.Cache):
+            return {}
+        t_hashes = sorted({projected_hash(t, self.external_theory_fields) for t in ts})
+        o_hashes = sorted({projected_hash(o, self.external_ocard_fields) for o in os})
+        index = {}
+        # each key belongs to a single chunk, so the latest one wins anyhow
+        for t_chunk, o_chunk in itertools.product(
+            sql.chunks(t_hashes, chunk_size), sql.chunks(o_hashes, chunk_size)
+        ):
+            keys = session.query(
+                db.Cache.uid, db.Cache.t_hash, db.Cache.o_hash, db.Cache.pdf
+            ).filter(
+                db.Cache.external == self.external,
+                db.Cache.pdf.in_(set(pdfs)),
+                db.Cache.t_hash.in_(t_chunk),
+                db.Cache.o_hash.in_(o_chunk),
+            )
+            for uid, t_hash, o_hash, pdf in keys.order_by(db.Cache.uid):
+                index[(t_hash, o_hash, pdf)] = uid
+        return index
+
+    def print_cache_status(self, cached):
+        """
+        Report whether the external result was cached.
+
+        Parameters
+        ----------
+        cached : bool
+            cache status
+        """
+        if self.status is not None:
+            self.status.cached(cached)
+        if self.output != "full":
+            return
+        if cached:
+            self.console.print("Cache contains the external result")
+        else:
+            self.console.print("Compute external result")
+
+    def compute_config(self, t, o, pdf_name, use_replicas, ext=None):
+        """
+        Compute a single configuration, without accessing the DB.
+
+        Parameters
+        ----------
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        use_replicas: bool
+            if True use the full PDF set
+        ext : dict or None
+            cached external result, if ``None`` it is computed
+
+        Returns
+        -------
+        new_ext : dict or None
+            external result, if it has been computed
+        log_record : dict
+            log
+        metrics : dict
+            resources spent, see :class:`banana.data.db.Metrics`
+        profiles : dict
+            profiling statistics, by stage (see :meth:`profile_threshold`)
+        """
+        return self.compute_configs(t, [o], pdf_name, use_replicas, [ext])[0]
+
+    def compute_configs(self, t, os, pdf_name, use_replicas, exts):
+        """
+        Compute the configurations of a theory and a PDF, without accessing
+        the DB.
+
+        Our program and the external are called once for all the o-cards
+        (see :meth:`run_me_batch` and :meth:`run_external_batch`), and the
+        time spent is split evenly among the configurations.
+        Profiles of the batched stages are attached to the first
+        configuration profiled.
+
+        Parameters
+        ----------
+        t : dict
+            theory card
+        os : list(dict)
+            o-cards
+        pdf_name : str
+            applied PDF
+        use_replicas: bool
+            if True use the full PDF set
+        exts : list(dict or None)
+            cached external results, the ``None`` ones are computed
+
+        Returns
+        -------
+        list(tuple(dict or None, dict, dict, dict))
+            for each configuration, new external result, log, metrics and
+            profiles (see :meth:`compute_config`)
+        """
+        watches = [Stopwatch() for _ in os]
+        profiles = [{} for _ in os]
+        thresholds = [self.profile_threshold(t, o, pdf_name) for o in os]
+        profiled_configs = [k for k, th in enumerate(thresholds) if th is not None]
+        missing = [k for k, ext in enumerate(exts) if ext is None]
+        child_peaks = []
+        # the process peak memory only grows, unless reset
+        reset = isolation.reset_peak_rss()
+        start_rss = isolation.peak_rss()
+
+        def profiled(stage):
+            return len(profiled_configs) > 0 and stage in self.profile_stages
+
+        def collect(stage, configs, wall, cpu, stats, peak=None):
+            # peak is only measured for stages run in a separate process
+            if peak is not None:
+                child_peaks.append(peak)
+            for k in configs:
+                watches[k].add(stage, wall / len(configs), cpu / len(configs))
+            if stats is not None:
+                first = profiled_configs[0]
+                if wall >= thresholds[first]:
+                    profiles[first][stage] = stats
+
+        load = Stopwatch()
+        with load("pdf"):
+            pdf = get_pdf(pdf_name, full_set=use_replicas)
+        collect(
+            "pdf",
+            range(len(os)),
+            load.metrics["pdf_wall"],
+            load.metrics["pdf_cpu"],
+            None,
+        )
+
+        mode = self.concurrent_external
+        if mode == "thread" and profiled("me") and profiled("ext"):
+            # only a profiler at a time can be active in a process (enforced
+            # since Python 3.12)
+            mode = "process"
+        # stages overlapping on threads only account for their own CPU time
+        threaded = mode == "thread" and len(missing) > 0
+
+        def measure(stage, pool=None):
+            # call a stage, eventually isolated or submitted to a pool
+            ocards = os if stage == "me" else [os[k] for k in missing]
+            kwargs = {"profile": profiled(stage)}
+            if stage in self.isolate:
+                entry = {"me": _run_me, "ext": _compute_external}[stage]
+                job = (isolation.isolated, stage, self.timeout, self.memory_limit)
+                job += (entry,)
+                job += (self, t, ocards, pdf_name, use_replicas)
+            elif isinstance(pool, concurrent.futures.ProcessPoolExecutor):
+                # PDF objects can not be pickled, only the external is submitted
+                job = (isolation.measure_child, _compute_external, self, t, ocards)
+                job += (pdf_name, use_replicas)
+            else:
+                function = {
+                    "me": self.run_me_batch,
+                    "ext": self.compute_external_batch,
+                }[stage]
+                job = (isolation.measure, function, t, ocards, pdf)
+                kwargs["thread"] = threaded
+            if pool is None:
+                return job[0](*job[1:], **kwargs)
+            return pool.submit(*job, **kwargs)
+
+        new_exts = [None for _ in os]
+        if len(missing) > 0 and mode is not None:
+            # get external, while computing our result
+            if mode == "thread":
+                executor = concurrent.futures.ThreadPoolExecutor
+            elif mode == "process":
+                executor = concurrent.futures.ProcessPoolExecutor
+            else:
+                raise ValueError(
+                    f"Unknown concurrency mode '{self.concurrent_external}'"
+                )
+            with executor(max_workers=1) as pool:
+                future = measure("ext", pool)
+                mes, *measures = measure("me")
+                collect("me", range(len(os)), *measures)
+                computed, *measures = future.result()
+            collect("ext", missing, *measures)
+        else:
+            # get our result
+            mes, *measures = measure("me")
+            collect("me", range(len(os)), *measures)
+            # get external, if not cached
+            computed = []
+            if len(missing) > 0:
+                computed, *measures = measure("ext")
+                collect("ext", missing, *measures)
+        exts = list(exts)
+        for k, ext in zip(missing, computed):
+            exts[k] = new_exts[k] = ext
+        rss = isolation.peak_rss()
+        if not reset and rss is not None:
+            rss -= start_rss
+        rss = max([r for r in [rss, *child_peaks] if r is not None], default=None)
+        outcomes = []
+        for o, me, ext, new_ext, watch, profile in zip(
+            os, mes, exts, new_exts, watches, profiles
+        ):
+            with watch("log"):
+                log_record = self.log(t, o, pdf, me, ext)
+            watch.metrics["peak_rss"] = rss
+            outcomes.append((new_ext, log_record, watch.metrics, profile))
+        return outcomes
+
+    def store_config(
+        self,
+        session,
+        t,
+        o,
+        pdf_name,
+        new_ext,
+        log_record,
+        metrics=None,
+        profiles=None,
+    ):
+        """
+        Save the outcome of a single configuration.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        new_ext : dict or None
+            external result, if it has been computed
+        log_record : dict
+            log
+        metrics : dict or None
+            resources spent, if not ``None`` they are stored as well
+        profiles : dict or None
+            profiling statistics, by stage, stored if any
+        """
+        watch = Stopwatch()
+        with watch("store"):
+            cache_hash = None
+            if new_ext is not None:
+                cache_hash = self.store_external(session, t, o, pdf_name, new_ext)
+            log_hash = self.store_log(session, t, o, pdf_name, log_document(log_record))
+        if metrics is not None:
+            metrics = dict(metrics, log_hash=log_hash, cache_hash=cache_hash)
+            self.store_metrics(session, t, o, pdf_name, {**metrics, **watch.metrics})
+        for stage, stats in (profiles or {}).items():
+            self.store_profile(session, t, o, pdf_name, log_hash, stage, stats)
+        if self.output == "full":
+            log_record.fancy()
+        if self.status is not None:
+            self.status.advance()
+
+    def store_metrics(self, session, t, o, pdf_name, metrics):
+        """
+        Save the resources spent on a configuration.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        metrics : dict
+            resources spent, see :class:`banana.data.db.Metrics`
+        """
+        record = {
+            "t_hash": t["hash"],
+            "o_hash": o["hash"],
+            "pdf": pdf_name,
+            "external": self.external,
+            **metrics,
+        }
+        record = dict(sorted(record.items()))
+        record["hash"] = hashlib.sha256(pickle.dumps(record)).digest().hex()
+        self.get_writer(session).add(db.Metrics, record)
+
+    def store_profile(self, session, t, o, pdf_name, log_hash, stage, stats):
+        """
+        Save the profiling statistics of a stage.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        log_hash : str
+            hash of the related log
+        stage : str
+            profiled stage
+        stats : dict
+            raw profiling statistics, see :class:`cProfile.Profile`
+        """
+        record = {
+            "t_hash": t["hash"],
+            "o_hash": o["hash"],
+            "pdf": pdf_name,
+            "external": self.external,
+            "log_hash": log_hash,
+            "stage": stage,
+            "stats": pickle.dumps(stats),
+        }
+        record["hash"] = hashlib.sha256(pickle.dumps(record)).digest().hex()
+        self.get_writer(session).add(db.Profile, record)
+
+    def profile_threshold(self, t, o, pdf_name):
+        """
+        Decide whether to profile a configuration.
+
+        A configuration is profiled if any of :attr:`profile_stages` is
+        selected, and either its theory or o-card hash starts with one of
+        :attr:`profile_hashes`, it is sampled according to
+        :attr:`profile_rate`, or :attr:`profile_duration` is set.
+
+        Parameters
+        ----------
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+
+        Returns
+        -------
+        float or None
+            minimum duration (in seconds) of a stage to keep its profile, or
+            ``None`` if the configuration is not profiled
+        """
+        if len(self.profile_stages) == 0:
+            return None
+        if any(
+            t["hash"].startswith(prefix) or o["hash"].startswith(prefix)
+            for prefix in self.profile_hashes
+        ):
+            return 0.0
+        if self.profile_rate > 0.0:
+            if int(config_hash(t, o, pdf_name)[:16], 16) < self.profile_rate * 2**64:
+                return 0.0
+        return self.profile_duration
+
+    def run_config(self, session, t, o, pdf_name, use_replicas):
+        """
+        Run a single configuration.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        use_replicas: bool
+            if True use the full PDF set
+
+        Returns
+        -------
+        bool
+            whether the configuration completed, otherwise the failure has
+            been recorded (see :meth:`store_failure`)
+        """
+        return self.run_batch(session, t, [o], pdf_name, use_replicas)
+
+    def run_batch(self, session, t, os, pdf_name, use_replicas):
+        """
+        Run the configurations of a theory and a PDF, see
+        :meth:`compute_configs`.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        os : list(dict)
+            o-cards
+        pdf_name : str
+            applied PDF
+        use_replicas: bool
+            if True use the full PDF set
+
+        Returns
+        -------
+        bool
+            whether the configurations completed, otherwise the failure has
+            been recorded for each of them (see :meth:`store_failure`)
         """
-        # obtain data
-        # TODO: quickfix for different eko/yadism format
-        log_record = self.log(t, o, pdf, me, ext)
-        if isinstance(log_record, dfdict.DFdict):
-            log_document = log_record.to_document()
+        # get external from cache if possible
+        watches, exts = [], []
+        for o in os:
+            watches.append(Stopwatch())
+            with watches[-1]("cache"):
+                exts.append(self.cached_external(session, t, o, pdf_name))
+            self.print_cache_status(exts[-1] is not None)
+        try:
+            outcomes = self.retrying(
+                self.compute_configs, t, os, pdf_name, use_replicas, exts
+            )
+        except Exception as err:  # pylint:disable=broad-except
+            skip = [self.skip_failure(session, t, o, pdf_name, err) for o in os]
+            if not all(skip):
+                raise
+            return False
+        for o, watch, (new_ext, log_record, metrics, profiles) in zip(
+            os, watches, outcomes
+        ):
+            metrics.update(watch.metrics)
+            self.store_config(
+                session, t, o, pdf_name, new_ext, log_record, metrics, profiles
+            )
+        return True
+
+    def config_groups(self, configs):
+        """
+        Group configurations by theory and PDF, if :meth:`batched`.
+
+        Parameters
+        ----------
+        configs : iterable(tuple(dict, dict, str))
+            configurations to run, i.e. theory card, o-card and PDF name
+
+        Returns
+        -------
+        list(tuple(dict, list(dict), str))
+            theory card, o-cards and PDF name of each group, in order of first
+            appearance (single o-card groups, if not batched)
+        """
+        if not self.batched():
+            return [(t, [o], pdf_name) for t, o, pdf_name in configs]
+        groups = {}
+        for t, o, pdf_name in configs:
+            groups.setdefault((t["hash"], pdf_name), (t, [], pdf_name))[1].append(o)
+        return list(groups.values())
+
+    def retrying(self, function, *args):
+        """
+        Call a function, retrying transient failures.
+
+        Failures are transient according to :meth:`is_transient`, and they
+        are retried up to :attr:`retries` times, with exponential backoff (see
+        :attr:`retry_backoff`).
+
+        Parameters
+        ----------
+        function : callable
+            function to call
+        args : list
+            function arguments
+
+        Returns
+        -------
+        any
+            function result
+        """
+        for attempt in itertools.count():
+            try:
+                return function(*args)
+            except self.retry_errors as err:
+                if attempt >= self.retries or not self.is_transient(err):
+                    raise
+                delay = self.retry_backoff * 2**attempt
+                if self.output == "full":
+                    self.console.print(
+                        f"[yellow]Retrying[/yellow] in {delay} s, after: {err!r}"
+                    )
+                time.sleep(delay)
+
+    def is_transient(self, error):
+        """
+        Decide whether a failure might not happen again.
+
+        Errors are transient if they are instances of :attr:`retry_errors`,
+        except for isolated stages exceeding their limits, since the same
+        configuration would most likely exceed them again.
+
+        Parameters
+        ----------
+        error : Exception
+            raised error
+
+        Returns
+        -------
+        bool
+            whether the error is transient
+        """
+        if isinstance(error, isolation.IsolationError) and error.reason in (
+            "timeout",
+            "memory",
+        ):
+            return False
+        return isinstance(error, self.retry_errors)
+
+    def skip_failure(self, session, t, o, pdf_name, error):
+        """
+        Record the failure of a configuration, and decide whether to go on.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        error : Exception
+            failure
+
+        Returns
+        -------
+        bool
+            whether the configuration can be skipped, see
+            :attr:`continue_on_error`
+        """
+        self.store_failure(session, t, o, pdf_name, error)
+        return self.continue_on_error or isinstance(error, isolation.IsolationError)
+
+    def store_failure(self, session, t, o, pdf_name, error):
+        """
+        Save the failure of a configuration.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        error : Exception
+            failure, the stage is only known for
+            :class:`~banana.benchmark.isolation.IsolationError`
+        """
+        record = {
+            "t_hash": t["hash"],
+            "o_hash": o["hash"],
+            "pdf": pdf_name,
+            "external": self.external,
+        }
+        if isinstance(error, isolation.IsolationError):
+            record.update(
+                stage=error.stage,
+                reason=error.reason,
+                exc_type=error.exc_type,
+                message=error.detail,
+                traceback=error.trace,
+            )
         else:
-            log_document = dict(
-                map(lambda t: (t[0], t[1].to_document()), log_record.items())
+            record.update(
+                stage=None,
+                reason="exception",
+                exc_type=type(error).__name__,
+                message=str(error),
+                traceback="".join(
+                    traceback.format_exception(type(error), error, error.__traceback__)
+                ),
             )
+        # the same failure may happen again
+        record["hash"] = hashlib.sha256(pickle.dumps((record, time.time()))).hexdigest()
+        self.get_writer(session).add(db.Failure, record)
+        if self.output == "full":
+            self.console.print(f"[red]Failed[/red] {type(error).__name__}: {error}")
+        if self.status is not None:
+            self.status.advance(failed=True)
+
+    def store_log(self, session, t, o, pdf_name, log_document):
+        """
+        Save a log.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        log_document : dict
+            raw log, see :func:`log_document`
+
+        Returns
+        -------
+        str
+            log record hash
 
+        Note
+        ----
+        The record might be buffered, see :meth:`get_writer`.
+        """
         # create record
         record = {
             "t_hash": t["hash"],
             "o_hash": o["hash"],
-            "pdf": pdf_name(pdf),
+            "pdf": pdf_name,
             "external": self.external,
             # TODO: pay attention, the hash will be computed on the binarized
             "log": pickle.dumps(log_document),
         }
         log_hash = hashlib.sha256(pickle.dumps(record)).digest().hex()
-        new_log = db.Log(
-            **record,
-            hash=log_hash,
-        )
-        try:
-            session.add(new_log)
-            session.commit()
-            print(f"\nLog added, hash={log_hash}\n")
-        except sqlalchemy.exc.IntegrityError:
-            session.rollback()
+        record["hash"] = log_hash
+
+        def on_commit(_new_log):
+            if self.output == "full":
+                print(f"\nLog added, hash={log_hash}\n")
+
+        def on_duplicate():
             sql.update_atime(
                 session, db.Log, [sql.select_by_hash(session, db.Log, log_hash)["uid"]]
             )
-            print(f"\nLog already present, hash={log_hash}\n")
+            if self.output == "full":
+                print(f"\nLog already present, hash={log_hash}\n")
+
+        self.get_writer(session).add(
+            db.Log, record, on_commit=on_commit, on_duplicate=on_duplicate
+        )
+        return log_hash
+
+    def insert_log(self, session, t, o, pdf, me, ext):
+        """
+        Obtain an external run.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        me : dict
+            our result
+        ext : str
+            external result
+
+        Returns
+        -------
+        log_record : dict
+            result
+        """
+        # obtain data
+        log_record = self.log(t, o, pdf, me, ext)
+        self.store_log(session, t, o, pdf_name(pdf), log_document(log_record))
         return log_record
 
-    def run(self, theory_updates, ocard_updates, pdfs, use_replicas=False):
+    def run(
+        self,
+        theory_updates,
+        ocard_updates,
+        pdfs,
+        use_replicas=False,
+        workers=1,
+        resume=False,
+        shard=None,
+        queue=False,
+        failed=False,
+    ):
         """
         Execute a (power) set of configuration and compare.
 
@@ -384,6 +1877,22 @@ class BenchmarkRunner:
                 applied PDFs
             use_replicas : bool
                 if True use the full PDFs set
+            workers : int
+                number of processes computing configurations; only the
+                calling process is accessing the DB (default: ``1``, i.e.
+                serial execution)
+            resume : bool
+                if True skip the configurations already logged, e.g. by an
+                interrupted run (default: ``False``)
+            shard : tuple(int, int) or None
+                if not ``None``, only run the configurations belonging to
+                shard ``i`` out of ``N`` (see :meth:`shard_configurations`)
+            queue : bool
+                if True only fill the job queue, leaving the execution to
+                independent workers (see :meth:`work`)
+            failed : bool
+                if True only run again the configurations that failed, and
+                have not been logged since (default: ``False``)
 
         """
         # open db
@@ -392,22 +1901,541 @@ class BenchmarkRunner:
         # init input
         ts = theories.load(session, theory_updates)
         os = self.load_ocards(session, ocard_updates)
+        # iterate all combinations
+        full, skipped = self.configurations(
+            session, ts, os, pdfs, resume, shard, failed
+        )
+        # make sure no installation is needed during the run
+        self.prepare_pdfs(sorted({pdf for _, _, pdf in full}))
+        load_info = f"Theories: {len(ts)} OCards: {len(os)} PDFs: {len(pdfs)} ext: {self.external}"
+        if shard is not None:
+            load_info += f"\nShard: {shard[0]}/{shard[1]}"
+        if resume or failed:
+            load_info += f"\nSkipped: {skipped}"
+        if queue:
+            queued = self.enqueue(session, full, use_replicas)
+            load_info += f"\nQueued: {queued}/{len(full)}"
+            self.console.print(rich.panel.Panel.fit(load_info, rich.box.HORIZONTALS))
+            return
+        # resolve cache hits and misses up front
+        self.cache_index = self.prefetch_external(session, ts, os, pdfs)
+        hits = sum(self.cache_key(t, o, pdf) in self.cache_index for t, o, pdf in full)
+        load_info += f"\nCached: {hits}/{len(full)}"
         # print some load information
-        self.console.print(
-            rich.panel.Panel.fit(
-                f"Theories: {len(ts)} OCards: {len(os)} PDFs: {len(pdfs)} ext: {self.external}",
-                rich.box.HORIZONTALS,
+        self.console.print(rich.panel.Panel.fit(load_info, rich.box.HORIZONTALS))
+        self.writer = sql.WriteBehind(session, self.commit_every, self.commit_interval)
+        self.status = RunStatus(self.console, len(full), self.output == "progress")
+        if use_replicas and self.replica_workers > 1:
+            self.replica_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.replica_workers
             )
-        )
-        # iterate all combinations
-        full = itertools.product(ts, os, pdfs)
-        # for t, o, pdf_name in rich.progress.track(
-        #    full, total=len(ts) * len(os) * len(pdfs), console=self.console
-        # ):
-        # TODO find a way to display 2 progress bars
-        for t, o, pdf_name in full:
+        try:
+            with self.status:
+                if workers > 1:
+                    self.run_parallel(session, full, use_replicas, workers)
+                else:
+                    costs = {}
+                    if self.commit_interval is not None:
+                        costs = self.config_costs(session)
+                    for t, os, pdf_name in self.config_groups(full):
+                        # records can not be flushed while computing
+                        self.writer.maybe_flush(
+                            sum(
+                                costs.get((t["hash"], o["hash"], pdf_name), 0.0)
+                                for o in os
+                            )
+                        )
+                        for o in os:
+                            self.print_config(t, o, pdf_name)
+                        self.run_batch(session, t, os, pdf_name, use_replicas)
+        finally:
+            # commit whatever is left
+            self.writer.flush()
             self.console.print(
-                f"Computing for theory=[b]{t['hash'][:7]}[/b], "
-                + f"ocard=[b]{o['hash'][:7]}[/b] and pdf=[b]{pdf_name}[/b] ..."
+                rich.panel.Panel.fit(self.status.summary(), rich.box.HORIZONTALS)
+            )
+            self.writer = None
+            self.cache_index = None
+            self.status = None
+            if self.replica_pool is not None:
+                self.replica_pool.shutdown()
+                self.replica_pool = None
+
+    def prepare_pdfs(self, pdfs):
+        """
+        Install the missing PDF sets, and check that all of them load.
+
+        Sets are installed in parallel, eventually from :attr:`pdf_mirror`,
+        and only the central member is loaded, so that installation is never
+        happening during the run.
+
+        Parameters
+        ----------
+        pdfs : list(str)
+            applied PDFs
+
+        Raises
+        ------
+        ValueError
+            if any of the sets could not be installed, or loaded
+        """
+        # refresh the installed PDF sets, once per run
+        available_pdf_sets.cache_clear()
+        # do not even look for LHAPDF, if not needed
+        lhapdf_sets = set(pdfs) - {"ToyLH", "ToyLH_polarized"}
+        missing = []
+        if len(lhapdf_sets) > 0:
+            missing = sorted(lhapdf_sets - available_pdf_sets())
+        errors = {}
+        if len(missing) > 0:
+            self.console.print(f"Installing PDF sets: {', '.join(missing)}")
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.pdf_install_workers
+            ) as pool:
+                futures = {
+                    pdf: pool.submit(install_pdf, pdf, self.pdf_mirror)
+                    for pdf in missing
+                }
+            for pdf, future in futures.items():
+                if future.exception() is not None:
+                    errors[pdf] = future.exception()
+            available_pdf_sets.cache_clear()
+        for pdf in sorted(set(pdfs)):
+            if pdf in errors:
+                continue
+            try:
+                get_pdf(pdf)
+            except Exception as err:  # pylint:disable=broad-except
+                errors[pdf] = err
+        if len(errors) > 0:
+            raise ValueError(
+                "Unusable PDF sets: "
+                + ", ".join(f"{pdf} ({err!r})" for pdf, err in sorted(errors.items()))
+            )
+
+    def configurations(
+        self, session, ts, os, pdfs, resume=False, shard=None, failed=False
+    ):
+        """
+        Expand all the configurations to run.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        ts : list(dict)
+            theory cards
+        os : list(dict)
+            o-cards
+        pdfs : list(str)
+            applied PDFs
+        resume : bool
+            if True skip the configurations already logged
+        shard : tuple(int, int) or None
+            if not ``None``, only keep the configurations of the given shard
+        failed : bool
+            if True only keep the configurations that failed (see
+            :meth:`failed_configs`)
+
+        Returns
+        -------
+        list(tuple(dict, dict, str))
+            theory card, o-card and PDF name of each configuration
+        int
+            number of configurations skipped, since already logged (or not
+            failed)
+        """
+        full = list(itertools.product(ts, os, pdfs))
+        # shard before resuming, so the partition does not depend on progress
+        if shard is not None:
+            full = self.shard_configurations(full, shard)
+        n_configs = len(full)
+        if resume:
+            done = self.logged_configs(session, ts, os, pdfs)
+            full = [c for c in full if (c[0]["hash"], c[1]["hash"], c[2]) not in done]
+        if failed:
+            todo = self.failed_configs(session, ts, os, pdfs)
+            full = [c for c in full if (c[0]["hash"], c[1]["hash"], c[2]) in todo]
+        return full, n_configs - len(full)
+
+    def shard_configurations(self, configs, shard):
+        """
+        Select the configurations of a shard.
+
+        Configurations are assigned by their :func:`~banana.benchmark.queue.config_hash` (or by their
+        theory hash, if :attr:`theory_affinity` is set), so the shards are a
+        partition of the configurations, without any coordination.
+        If :attr:`shard_history` is set, the historical costs are used to
+        balance the shards: configurations (or theories) are assigned from the
+        most to the least expensive (unknown ones are assumed to cost as the
+        average) to the shard with the lowest load so far.
+
+        Parameters
+        ----------
+        configs : list(tuple(dict, dict, str))
+            theory card, o-card and PDF name of each configuration
+        shard : tuple(int, int)
+            the shard index ``i`` and the number of shards ``N``
+
+        Returns
+        -------
+        list(tuple(dict, dict, str))
+            configurations of the shard, in the original order
+        """
+        index, n_shards = shard
+        if not 0 <= index < n_shards:
+            raise ValueError(f"Shard {index} is not available out of {n_shards}")
+        if self.theory_affinity:
+            hashes = [t["hash"] for t, _, _ in configs]
+        else:
+            hashes = [config_hash(*config) for config in configs]
+        if self.shard_history is None:
+            return [
+                config
+                for config, h in zip(configs, hashes)
+                if int(h, 16) % n_shards == index
+            ]
+        history = sqlalchemy.orm.sessionmaker(db.engine(self.shard_history))()
+        costs = self.config_costs(history)
+        history.close()
+        default = sum(costs.values()) / len(costs) if len(costs) > 0 else 1.0
+        unit_costs = collections.defaultdict(float)
+        for h, (t, o, pdf_name) in zip(hashes, configs):
+            unit_costs[h] += costs.get((t["hash"], o["hash"], pdf_name), default)
+        loads = [(0.0, i) for i in range(n_shards)]
+        selected = set()
+        for h in sorted(unit_costs, key=lambda h: (-unit_costs[h], h)):
+            load, i = heapq.heappop(loads)
+            if i == index:
+                selected.add(h)
+            heapq.heappush(loads, (load + unit_costs[h], i))
+        return [config for config, h in zip(configs, hashes) if h in selected]
+
+    def config_costs(self, session):
+        """
+        Collect the average time spent on each configuration.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+
+        Returns
+        -------
+        dict
+            average time (in seconds), indexed by theory hash, o-card hash and
+            PDF name
+        """
+        if not self.has_table(session, db.Metrics):
+            return {}
+        costs = (
+            session.query(
+                db.Metrics.t_hash,
+                db.Metrics.o_hash,
+                db.Metrics.pdf,
+                sqlalchemy.func.avg(total_wall()),
+            )
+            .filter(db.Metrics.external == self.external)
+            .group_by(db.Metrics.t_hash, db.Metrics.o_hash, db.Metrics.pdf)
+        )
+        return {(t_hash, o_hash, pdf): cost for t_hash, o_hash, pdf, cost in costs}
+
+    def historical_costs(self, session, max_gap=3600.0):
+        """
+        Estimate the average time spent on a configuration by each external.
+
+        The estimate is based on the recorded :class:`~banana.data.db.Metrics`,
+        separately for configurations whose external result was cached (hits)
+        or computed (misses).
+        For externals without metrics, it is based on the creation time of
+        consecutive logs of the same external, while larger gaps are considered
+        to separate different runs (and hits and misses are not distinguished).
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        max_gap : float
+            maximum time (in seconds) between consecutive logs of the same run
+
+        Returns
+        -------
+        dict
+            average time (in seconds) per configuration, for ``"hit"`` and
+            ``"miss"``, by external
+        """
+        spans = collections.defaultdict(lambda: [0.0, 0])
+        previous = None
+        logs = []
+        if self.has_table(session, db.Log):
+            logs = session.query(db.Log.external, db.Log.ctime).order_by(db.Log.uid)
+        for external, ctime in logs:
+            if previous is not None and previous[0] == external:
+                delta = (ctime - previous[1]).total_seconds()
+                if 0.0 <= delta <= max_gap:
+                    spans[external][0] += delta
+                    spans[external][1] += 1
+            previous = (external, ctime)
+        costs = {
+            ext: dict(hit=total / count, miss=total / count)
+            for ext, (total, count) in spans.items()
+        }
+        # prefer actual measurements
+        if not self.has_table(session, db.Metrics):
+            return costs
+        hit = db.Metrics.cache_hash.is_(None)
+        measured = collections.defaultdict(dict)
+        for external, is_hit, cost in session.query(
+            db.Metrics.external, hit, sqlalchemy.func.avg(total_wall())
+        ).group_by(db.Metrics.external, hit):
+            measured[external]["hit" if is_hit else "miss"] = cost
+        for ext, cost in measured.items():
+            costs[ext] = dict(
+                hit=cost.get("hit", cost.get("miss")),
+                miss=cost.get("miss", cost.get("hit")),
+            )
+        return costs
+
+    def plan(
+        self,
+        theory_updates,
+        ocard_updates,
+        pdfs,
+        resume=False,
+        shard=None,
+        failed=False,
+    ):
+        """
+        Report what a run would do, without running it.
+
+        Nothing is written to the DB: theories are only hashed, o-cards are
+        generated by :meth:`prepare_ocards`, and the DB is opened read-only,
+        neither created (a missing one is considered empty) nor migrated (the
+        missing tables are considered empty, see :meth:`has_table`).
+
+        Parameters
+        ----------
+            theory_updates : list(dict)
+                generated theories
+            ocard_updates : list(dict)
+                generated ocards
+            pdfs : list(str)
+                applied PDFs
+            resume : bool
+                if True skip the configurations already logged
+            shard : tuple(int, int) or None
+                if not ``None``, only consider the given shard
+            failed : bool
+                if True only consider the configurations that failed
+
+        Returns
+        -------
+            dict
+                number of configurations, skipped configurations, cache hits
+                and misses, historical costs per configuration by external
+                (see :meth:`historical_costs`), and estimated time (in seconds,
+                ``None`` if no previous record is available for the current
+                external)
+        """
+        db_path = self.banana_cfg["paths"]["database"]
+        if pathlib.Path(db_path).exists():
+            engine = db.engine(db_path, read_only=True)
+            session = sqlalchemy.orm.sessionmaker(bind=engine)()
+        else:
+            session = self.scratch_db()
+        ts, _ = sql.prepare_records(theories.default_card, theory_updates)
+        os = self.prepare_ocards(ocard_updates)
+        full, skipped = self.configurations(
+            session, ts, os, pdfs, resume, shard, failed
+        )
+        index = self.prefetch_external(session, ts, os, pdfs)
+        hits = sum(self.cache_key(t, o, pdf) in index for t, o, pdf in full)
+        costs = self.historical_costs(session)
+        estimate = None
+        if self.external in costs:
+            cost = costs[self.external]
+            estimate = hits * cost["hit"] + (len(full) - hits) * cost["miss"]
+        report = dict(
+            configs=len(full),
+            skipped=skipped,
+            hits=hits,
+            misses=len(full) - hits,
+            costs=costs,
+            estimate=estimate,
+        )
+        self.print_plan(report)
+        return report
+
+    def print_plan(self, report):
+        """
+        Display a run plan.
+
+        Parameters
+        ----------
+        report : dict
+            plan, as returned by :meth:`plan`
+        """
+        lines = [
+            f"Configurations: {report['configs']} (skipped: {report['skipped']})",
+            f"Cached: {report['hits']} Missing: {report['misses']}",
+        ]
+        for ext, cost in sorted(report["costs"].items()):
+            lines.append(
+                f"ext: {ext} - cached: {cost['hit']:.3g} s/config"
+                + f", missing: {cost['miss']:.3g} s/config"
             )
-            self.run_config(session, t, o, pdf_name, use_replicas)
+        if report["estimate"] is not None:
+            estimate = pendulum.duration(seconds=report["estimate"]).in_words()
+            lines.append(f"Estimated time: {estimate}")
+        self.console.print(rich.panel.Panel.fit("\n".join(lines), rich.box.HORIZONTALS))
+
+    def print_config(self, t, o, pdf_name):
+        """
+        Announce the configuration being processed.
+
+        Parameters
+        ----------
+        t : dict
+            theory card
+        o : dict
+            o-card
+        pdf_name : str
+            applied PDF
+        """
+        if self.output != "full":
+            return
+        self.console.print(
+            f"Computing for theory=[b]{t['hash'][:7]}[/b], "
+            + f"ocard=[b]{o['hash'][:7]}[/b] and pdf=[b]{pdf_name}[/b] ..."
+        )
+
+    def run_parallel(self, session, configs, use_replicas, workers):
+        """
+        Run configurations on a pool of processes.
+
+        Workers are only computing, while the DB is only accessed by the
+        calling process, so there is a single writer.
+        Results are stored in the same order of submission, so the outcome is
+        the same of a serial run.
+        Each worker computes a whole group of configurations, see
+        :meth:`config_groups`, and if :attr:`theory_affinity` is set, all the
+        groups of a theory are computed by the same worker, see
+        :meth:`pin_groups`.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.session.Session
+            DB ORM session
+        configs : iterable(tuple(dict, dict, str))
+            configurations to run, i.e. theory card, o-card and PDF name
+        use_replicas: bool
+            if True use the full PDF set
+        workers : int
+            number of processes
+        """
+        groups = self.config_groups(configs)
+        if self.theory_affinity:
+            pools = [
+                concurrent.futures.ProcessPoolExecutor(max_workers=1)
+                for _ in range(workers)
+            ]
+            schedule = self.pin_groups(groups, workers)
+        else:
+            pools = [concurrent.futures.ProcessPoolExecutor(max_workers=workers)]
+            schedule = [(0, group) for group in groups]
+        with contextlib.ExitStack() as stack:
+            for pool in pools:
+                stack.enter_context(pool)
+            pending = collections.deque()
+
+            def store_first():
+                t, os, pdf_name, watches, future = pending.popleft()
+                for o in os:
+                    self.print_config(t, o, pdf_name)
+                # keep flushing due records, while waiting
+                while self.writer.remaining() is not None:
+                    done, _ = concurrent.futures.wait(
+                        [future], timeout=max(self.writer.remaining(), 0.0)
+                    )
+                    if len(done) > 0:
+                        break
+                    self.writer.maybe_flush()
+                try:
+                    outcomes = future.result()
+                except Exception as err:  # pylint:disable=broad-except
+                    skip = [self.skip_failure(session, t, o, pdf_name, err) for o in os]
+                    if not all(skip):
+                        raise
+                    return
+                for o, watch, (new_ext, log_doc, metrics, profiles) in zip(
+                    os, watches, outcomes
+                ):
+                    metrics.update(watch.metrics)
+                    self.print_cache_status(new_ext is None)
+                    self.store_config(
+                        session,
+                        t,
+                        o,
+                        pdf_name,
+                        new_ext,
+                        log_from_document(log_doc),
+                        metrics,
+                        profiles,
+                    )
+
+            for worker, (t, os, pdf_name) in schedule:
+                watches, exts = [], []
+                for o in os:
+                    watches.append(Stopwatch())
+                    with watches[-1]("cache"):
+                        exts.append(self.cached_external(session, t, o, pdf_name))
+                future = pools[worker].submit(
+                    _compute_configs, self, t, os, pdf_name, use_replicas, exts
+                )
+                pending.append((t, os, pdf_name, watches, future))
+                # bound the amount of results held in memory
+                if len(pending) >= 2 * workers:
+                    store_first()
+            while len(pending) > 0:
+                store_first()
+
+    @staticmethod
+    def pin_groups(groups, workers):
+        """
+        Assign the groups of configurations to workers, by theory.
+
+        Theories are assigned from the one with most configurations to the
+        least loaded worker, then the groups are interleaved among workers,
+        so that all of them are busy when submitting in order.
+
+        Parameters
+        ----------
+        groups : list(tuple(dict, list(dict), str))
+            theory card, o-cards and PDF name of each group
+        workers : int
+            number of workers
+
+        Returns
+        -------
+        list(tuple(int, tuple(dict, list(dict), str)))
+            worker and group, in submission order
+        """
+        sizes = collections.Counter()
+        for t, os, _ in groups:
+            sizes[t["hash"]] += len(os)
+        loads = [(0, i) for i in range(workers)]
+        assigned = {}
+        for t_hash in sorted(sizes, key=lambda h: (-sizes[h], h)):
+            load, i = heapq.heappop(loads)
+            assigned[t_hash] = i
+            heapq.heappush(loads, (load + sizes[t_hash], i))
+        queues = [[] for _ in range(workers)]
+        for group in groups:
+            worker = assigned[group[0]["hash"]]
+            queues[worker].append((worker, group))
+        return [
+            job
+            for round_ in itertools.zip_longest(*queues)
+            for job in round_
+            if job is not None
+        ]
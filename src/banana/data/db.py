@@ -12,7 +12,7 @@ import pathlib
 from datetime import datetime, timezone
 
 import sqlalchemy
-from sqlalchemy import Column, DateTime, Float, Integer, String, Text
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, Text
 
 # from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -88,14 +88,58 @@ class CalcResult:
 
 class Cache(CalcResult, Base):
     __tablename__ = "cache"
+    __table_args__ = (Index("ix_cache_config", "t_hash", "o_hash", "pdf", "external"),)
     result = Column(Text)
 
 
 class Log(CalcResult, Base):
     __tablename__ = "logs"
+    __table_args__ = (Index("ix_logs_config", "t_hash", "o_hash", "pdf", "external"),)
     log = Column(Text)
 
 
+stages = ["pdf", "me", "cache", "ext", "log", "store"]
+"""Runner stages, whose timings are recorded in :class:`Metrics`"""
+
+
+class Metrics(CalcResult, Base):
+    """Resources spent on a single configuration.
+
+    Wall and CPU times (in seconds) are recorded for each of the
+    :data:`stages`, together with the peak resident set size (in KiB) while
+    computing the configuration, including the stages run in separate
+    processes (where the peak can not be reset, i.e. outside Linux, the growth
+    of the process peak is recorded instead).
+
+    """
+
+    __tablename__ = "metrics"
+    log_hash = Column(String(64))
+    cache_hash = Column(String(64))
+    peak_rss = Column(Integer)
+    pdf_wall = Column(Float, default=0.0)
+    pdf_cpu = Column(Float, default=0.0)
+    me_wall = Column(Float, default=0.0)
+    me_cpu = Column(Float, default=0.0)
+    cache_wall = Column(Float, default=0.0)
+    cache_cpu = Column(Float, default=0.0)
+    ext_wall = Column(Float, default=0.0)
+    ext_cpu = Column(Float, default=0.0)
+    log_wall = Column(Float, default=0.0)
+    log_cpu = Column(Float, default=0.0)
+    store_wall = Column(Float, default=0.0)
+    store_cpu = Column(Float, default=0.0)
+
+
+class Profile(CalcResult, Base):
+    """Profiling statistics of a runner stage, for a single configuration."""
+
+    __tablename__ = "profiles"
+    log_hash = Column(String(64))
+    stage = Column(Text)
+    stats = Column(Text)
+
+
 def engine(
     path="",
     dialect="sqlite",
@@ -104,6 +148,7 @@ def engine(
     password=None,
     host=None,
     port=None,
+    read_only=False,
 ):
     # Create an engine that stores data in the local directory
     infrastructure = dialect
@@ -119,6 +164,9 @@ def engine(
         address += f":{port}"
     if path:
         path = "/" + str(pathlib.Path(path).absolute())
+        # only supported by SQLite, through its URI filenames
+        if read_only and dialect == "sqlite":
+            path = f"/file:{path[1:]}?mode=ro&uri=true"
 
     return sqlalchemy.create_engine(f"{infrastructure}://{login}{address}{path}")
 
@@ -127,3 +175,97 @@ def create_db(base_cls, engine):
     # Create all tables in the engine. This is equivalent to "Create Table"
     # statements in raw SQL.
     base_cls.metadata.create_all(engine)
+    # and bring the existing ones up to date
+    migrate(base_cls, engine)
+
+
+def migrate(base_cls, engine):
+    """Update an existing database to the current schema, in place.
+
+    Only additive changes are applied: missing tables, columns and indexes are
+    created, while nothing is ever dropped or altered.
+    New columns are empty (``NULL``) for the existing rows.
+
+    Parameters
+    ----------
+    base_cls : sqlalchemy.ext.declarative.api.DeclarativeMeta
+        base class that describes db schema
+    engine : sqlalchemy.engine.Engine
+        database engine
+
+    Returns
+    -------
+    list(str)
+        changes applied
+
+    """
+    inspector = sqlalchemy.inspect(engine)
+    existing = set(inspector.get_table_names())
+    quote = engine.dialect.identifier_preparer.quote
+    applied = []
+    with engine.begin() as conn:
+        for table in base_cls.metadata.sorted_tables:
+            if table.name not in existing:
+                table.create(conn)
+                applied.append(f"table {table.name}")
+                continue
+            columns = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(
+                    sqlalchemy.text(
+                        f"ALTER TABLE {quote(table.name)} "
+                        + f"ADD COLUMN {quote(column.name)} {column_type}"
+                    )
+                )
+                applied.append(f"column {table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    applied.append(f"index {index.name}")
+    return applied
+
+
+class Job(CalcResult, Base):
+    """A configuration queued for execution, see
+    :meth:`banana.benchmark.runner.BenchmarkRunner.work`.
+
+    A job is ``"pending"`` until a worker claims it, and becomes
+    ``"running"`` until its ``lease`` expires, or it is marked as ``"done"``
+    (or ``"failed"``).
+    The worker owning the job keeps renewing the lease, as a heartbeat, so jobs
+    whose worker died get back in the queue as soon as the lease expires, up
+    to a maximum number of ``attempts`` (see
+    :attr:`banana.benchmark.queue.JobQueue.max_attempts`).
+
+    """
+
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_status", "external", "status"),)
+    theory = Column(Text)
+    ocard = Column(Text)
+    use_replicas = Column(Integer)
+    status = Column(Text, default="pending")
+    worker = Column(Text)
+    lease = Column(DateTime())
+    heartbeat = Column(DateTime())
+    attempts = Column(Integer, default=0)
+
+
+class Failure(CalcResult, Base):
+    """A configuration that did not complete.
+
+    The failing ``stage`` is one of the :data:`stages`, and ``reason`` is
+    ``"timeout"``, ``"memory"``, ``"crash"`` or ``"exception"``.
+
+    """
+
+    __tablename__ = "failures"
+    stage = Column(Text)
+    reason = Column(Text)
+    exc_type = Column(Text)
+    message = Column(Text)
+    traceback = Column(Text)
@@ -0,0 +1,103 @@
+"""Merge multiple databases into a single one.
+
+Rows are streamed in chunks, so memory usage is bounded by the chunk size, and
+deduplicated on their ``hash``.
+
+"""
+
+import sqlalchemy
+
+from . import db
+from .sql import dialect_inserts
+
+
+def upsert(table, dialect):
+    """Insert statement, keeping the newest access time on duplicates.
+
+    Parameters
+    ----------
+    table : sqlalchemy.schema.Table
+        target table
+    dialect : str
+        target database dialect
+
+    Returns
+    -------
+    sqlalchemy.sql.Insert
+        insert statement
+
+    """
+    try:
+        insert = dialect_inserts[dialect](table)
+    except KeyError as err:
+        raise NotImplementedError(f"Merge not available for {dialect}") from err
+    if "hash" not in table.c:
+        return insert
+    if "atime" not in table.c:
+        return insert.on_conflict_do_nothing(index_elements=["hash"])
+    return insert.on_conflict_do_update(
+        index_elements=["hash"],
+        set_={"atime": insert.excluded.atime},
+        where=sqlalchemy.or_(
+            table.c.atime.is_(None), insert.excluded.atime > table.c.atime
+        ),
+    )
+
+
+def merge(base_cls, target, sources, chunk_size=1000):
+    """Merge databases.
+
+    All the tables described by ``base_cls`` are merged, if available in the
+    sources.
+    Rows with an already present ``hash`` are not inserted again, but their
+    access time is updated, if newer.
+    The ``uid`` is not preserved, since it is only unique within each
+    database.
+
+    Parameters
+    ----------
+    base_cls : sqlalchemy.ext.declarative.api.DeclarativeMeta
+        base class that describes db schema (e.g. :class:`db.Base`)
+    target : str or os.PathLike
+        path to the target database, created if not existing
+    sources : list(str or os.PathLike)
+        paths to the source databases
+    chunk_size : int
+        number of rows transferred at once
+
+    Returns
+    -------
+    dict
+        number of rows read from the sources, by table
+
+    """
+    target_engine = db.engine(target)
+    db.create_db(base_cls, target_engine)
+    counts = {}
+    for source in sources:
+        source_engine = db.engine(source)
+        inspector = sqlalchemy.inspect(source_engine)
+        with source_engine.connect() as src, target_engine.begin() as tgt:
+            for table in base_cls.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                available = {col["name"] for col in inspector.get_columns(table.name)}
+                columns = [
+                    col
+                    for col in table.c
+                    if col.name in available and col.name != "uid"
+                ]
+                statement = upsert(table, target_engine.dialect.name)
+                rows = src.execution_options(stream_results=True).execute(
+                    sqlalchemy.select(*columns)
+                )
+                counts.setdefault(table.name, 0)
+                while True:
+                    chunk = rows.fetchmany(chunk_size)
+                    if len(chunk) == 0:
+                        break
+                    tgt.execute(statement, [dict(row._mapping) for row in chunk])
+                    counts[table.name] += len(chunk)
+        source_engine.dispose()
+    target_engine.dispose()
+    return counts
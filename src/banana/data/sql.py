@@ -1,12 +1,14 @@
 import copy
 import hashlib
 import pickle
+import time
 from datetime import datetime, timezone
 
 import numpy as np
 import pandas as pd
 import sqlalchemy.sql
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from . import dfdict
 
@@ -36,6 +38,26 @@ def serialize(data):
     return tuple(ndata)
 
 
+def decode(el):
+    """Undo the binary representation of a single field.
+
+    Parameters
+    ----------
+    el : bytes
+        pickled field
+
+    Returns
+    -------
+    object
+        decoded field
+
+    """
+    obj = pickle.loads(el)
+    if isinstance(obj, dict) and "__msgs__" in obj:
+        obj = dfdict.DFdict.from_document(obj)
+    return obj
+
+
 def deserialize(data):
     """Undo the binary representation.
 
@@ -55,14 +77,55 @@ def deserialize(data):
         if f[0] == "_":
             continue
         if isinstance(el, bytes):
-            obj[f] = pickle.loads(el)
-            if isinstance(obj[f], dict) and "__msgs__" in obj[f]:
-                obj[f] = dfdict.DFdict.from_document(obj[f])
+            obj[f] = decode(el)
         else:
             obj[f] = el
     return obj
 
 
+class Record(dict):
+    """Record whose binary fields are decoded lazily.
+
+    Fields are stored as read from the database, and :func:`decode` is applied
+    to binary ones on first access (through indexing, :meth:`get`,
+    :meth:`items`, or :meth:`values`), replacing the stored value.
+
+    Note
+    ----
+    Consumers reading the underlying :class:`dict` directly (e.g.
+    :class:`pandas.DataFrame`) will see the binary payloads: call
+    :meth:`decoded` to obtain a plain :class:`dict` in that case.
+
+    """
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, bytes):
+            value = decode(value)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def decoded(self):
+        """Decode all fields.
+
+        Returns
+        -------
+        dict
+            fully decoded record
+
+        """
+        return dict(self.items())
+
+
 def add_hash(record):
     """Add a hash value as last element to the record.
 
@@ -134,9 +197,42 @@ def insertmany(session, table, df):
         session.rollback()
 
 
-def insertnew(session, table, df):
+dialect_inserts = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+"""Insert statements supporting conflicts resolution, by dialect"""
+
+
+def chunks(values, chunk_size=500):
+    """Split values in lists of at most ``chunk_size`` elements.
+
+    Used to bound the number of parameters of ``IN`` clauses, since some
+    dialects are limiting them (e.g. SQLite).
+
+    Parameters
+    ----------
+    values : iterable
+        values to split
+    chunk_size : int
+        maximum number of values in a chunk
+
+    Returns
+    -------
+    list(list)
+        consecutive chunks
+
+    """
+    values = list(values)
+    return [
+        values[start : start + chunk_size]
+        for start in range(0, len(values), chunk_size)
+    ]
+
+
+def insertnew(session, table, df, chunk_size=500):
     """Insert all records that do not exist yet (determined by hash).
 
+    The check is performed by the database, on the batch only: for dialects
+    supporting it, with ``INSERT ... ON CONFLICT DO NOTHING``, otherwise
+    looking up the batch hashes, ``chunk_size`` at a time.
 
     Parameters
     ----------
@@ -146,12 +242,200 @@ def insertnew(session, table, df):
         target table
     df : pandas.DataFrame
         dataframe all records
+    chunk_size : int
+        number of hashes looked up at once, if the dialect is not supporting
+        conflicts resolution
+
+    Returns
+    -------
+    new : int
+        number of inserted records
+    existing : int
+        number of records already present (or repeated in the batch)
+
+    Raises
+    ------
+    sqlalchemy.exc.SQLAlchemyError
+        if the insertion fails, after rolling back
+
+    """
+    records = df.to_dict(orient="records")
+    if len(records) == 0:
+        return 0, 0
+    dialect = session.get_bind().dialect.name
+    if dialect not in dialect_inserts:
+        found = set()
+        for chunk in chunks(df["hash"], chunk_size):
+            found.update(
+                h for h, in session.query(table.hash).filter(table.hash.in_(chunk))
+            )
+        new_records = df[~df["hash"].isin(found)].drop_duplicates("hash")
+        try:
+            session.bulk_insert_mappings(table, new_records.to_dict(orient="records"))
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        return len(new_records), len(records) - len(new_records)
+    insert = dialect_inserts[dialect](table).on_conflict_do_nothing(
+        index_elements=["hash"]
+    )
+    try:
+        new = session.execute(insert, records).rowcount
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    return new, len(records) - new
+
+
+class WriteBehind:
+    """Buffer new records, and insert them in a single transaction.
+
+    Records are flushed as soon as ``every`` of them are pending, or the oldest
+    pending one is older than ``interval`` seconds, or :meth:`flush` is
+    called explicitly.
+
+    If the transaction fails because of duplicated records, they are inserted
+    one by one, and the duplicated ones are skipped.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.session.Session
+        DB ORM session
+    every : int
+        maximum number of pending records
+    interval : float or None
+        maximum delay (in seconds) of a pending record, if ``None`` no delay
+        limit is applied
 
     """
-    # TODO: why the hash field is a 1-tuple?
-    hashes = [h[0] for h in session.query(table.hash).all()]
-    new_records = df[~df["hash"].isin(hashes)]
-    insertmany(session, table, new_records)
+
+    def __init__(self, session, every=1, interval=None):
+        self.session = session
+        self.every = every
+        self.interval = interval
+        self.pending = []
+        self.since = None
+
+    def add(self, table, record, on_commit=None, on_duplicate=None):
+        """Add a new record to the buffer.
+
+        Parameters
+        ----------
+        table : sqlalchemy.ext.declarative.api.DeclarativeMeta
+            table object
+        record : dict
+            record columns
+        on_commit : callable or None
+            called with the inserted object, after the record has been committed
+        on_duplicate : callable or None
+            called without arguments, if the record is already present
+
+        """
+        self.pending.append((table, record, on_commit, on_duplicate))
+        if self.since is None:
+            self.since = time.monotonic()
+        if len(self.pending) >= self.every:
+            self.flush()
+        else:
+            self.maybe_flush()
+
+    def remaining(self):
+        """Time left before the oldest pending record is due.
+
+        Returns
+        -------
+        float or None
+            seconds (possibly negative), ``None`` if there is no pending
+            record or no ``interval``
+
+        """
+        if self.since is None or self.interval is None:
+            return None
+        return self.interval - (time.monotonic() - self.since)
+
+    def maybe_flush(self, ahead=0.0):
+        """Flush, if the oldest pending record is due.
+
+        Since records can only be flushed between computations, this should be
+        called before starting a new one.
+
+        Parameters
+        ----------
+        ahead : float
+            expected delay (in seconds) before the next check, records due
+            within it are flushed immediately
+
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining <= ahead:
+            self.flush()
+
+    def pending_records(self, table):
+        """List the records not yet flushed.
+
+        Parameters
+        ----------
+        table : sqlalchemy.ext.declarative.api.DeclarativeMeta
+            table object
+
+        Returns
+        -------
+        list(dict)
+            pending records for the given table
+
+        """
+        return [record for tab, record, _, _ in self.pending if tab is table]
+
+    def flush(self):
+        """Insert all pending records.
+
+        If the transaction fails for any other reason than duplicated
+        records, it is rolled back, the records not yet inserted are kept
+        pending, and the error is raised.
+
+        """
+        pending = self.pending
+        if len(pending) == 0:
+            return
+        objs = [table(**record) for table, record, _, _ in pending]
+        try:
+            self.session.add_all(objs)
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            self._flush_one_by_one()
+            return
+        except SQLAlchemyError:
+            self.session.rollback()
+            raise
+        self.pending, self.since = [], None
+        for obj, (_, _, on_commit, _) in zip(objs, pending):
+            if on_commit is not None:
+                on_commit(obj)
+
+    def _flush_one_by_one(self):
+        # one transaction per record, to spot duplicates
+        while len(self.pending) > 0:
+            table, record, on_commit, on_duplicate = self.pending[0]
+            obj = table(**record)
+            try:
+                self.session.add(obj)
+                self.session.commit()
+            except IntegrityError:
+                self.session.rollback()
+                self.pending.pop(0)
+                if on_duplicate is not None:
+                    on_duplicate()
+                continue
+            except SQLAlchemyError:
+                self.session.rollback()
+                raise
+            self.pending.pop(0)
+            if on_commit is not None:
+                on_commit(obj)
+        self.since = None
 
 
 class RetrieveError(KeyError):
@@ -173,12 +457,43 @@ class UIDError(RetrieveError):
     objects = "pids"
 
 
+def prefix_range(column, prefix):
+    """Build a filter matching the values of a string column by prefix.
+
+    The condition is expressed as a half-open range, ``prefix <= value <
+    upper``, where ``upper`` is the prefix with the last character incremented:
+    differently from ``substr`` (or an arbitrary function of the column), a
+    range can be served by an index on the column.
+
+    Parameters
+    ----------
+    column : sqlalchemy.schema.Column
+        string column to filter
+    prefix : str
+        leading characters to match
+
+    Returns
+    -------
+    sqlalchemy.sql.expression.ColumnElement
+        filter condition
+
+    """
+    if len(prefix) == 0:
+        return sqlalchemy.sql.true()
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return sqlalchemy.sql.and_(column >= prefix, column < upper)
+
+
 def select_by_hash(session, table_object, hash_partial):
     """Find a record by its partial hash.
 
     The hash provided is considered to be the first ``len(hash_partial)``
     carachters of a full hash in the table.
 
+    Only the matching hashes are looked up at first (with an index range scan,
+    see :func:`prefix_range`), and the full record is loaded only once it is
+    known to be unique.
+
     Parameters
     ----------
     session : sqlalchemy.orm.session.Session
@@ -194,21 +509,21 @@ def select_by_hash(session, table_object, hash_partial):
         record
 
     """
-    available = (
-        session.query(table_object)
-        .filter(
-            sqlalchemy.sql.func.substr(table_object.hash, 1, len(hash_partial))
-            == hash_partial
+    available = [
+        h
+        for (h,) in session.query(table_object.hash).filter(
+            prefix_range(table_object.hash, hash_partial)
         )
-        .all()
-    )
+    ]
     # too much?
     if len(available) > 1:
-        raise HashError("hash is not unique", [a.hash for a in available])
+        raise HashError("hash is not unique", available)
     if len(available) < 1:
         raise HashError("hash not found")
     # deserialize the thing
-    return deserialize(available[0])
+    return deserialize(
+        session.query(table_object).filter(table_object.hash == available[0]).one()
+    )
 
 
 def select_by_uid(session, table_object, uid):
@@ -247,8 +562,9 @@ def select_by_position(session, table_object, pos):
 
     Note
     ----
-    This is more expensive than using :func:`select_uid`, since the whole table
-    is retrieved, and only after a single member is selected.
+    Records are ordered by ``uid``, and the position is resolved in the query
+    itself (reversing the order for negative ones), so a single row is
+    retrieved.
 
     Parameters
     ----------
@@ -256,19 +572,35 @@ def select_by_position(session, table_object, pos):
         DB ORM session
     table_object : sqlalchemy.schema.Table
         table object
-    hash_partial : str
-        hash identifier
+    pos : int
+        position in the table
 
     Returns
     -------
     dict
         record
 
+    Raises
+    ------
+    IndexError
+        if the position is out of range
+
     """
-    return deserialize(session.query(table_object).all()[pos])
+    if pos >= 0:
+        query = session.query(table_object).order_by(table_object.uid).offset(pos)
+    else:
+        query = (
+            session.query(table_object)
+            .order_by(table_object.uid.desc())
+            .offset(-pos - 1)
+        )
+    record = query.limit(1).first()
+    if record is None:
+        raise IndexError("position out of range")
+    return deserialize(record)
 
 
-def select_all(session, table_object):
+def select_all(session, table_object, columns=None, lazy=False):
     """Collect all records.
 
     Parameters
@@ -277,6 +609,11 @@ def select_all(session, table_object):
         DB ORM session
     table_object : sqlalchemy.schema.Table
         table object
+    columns : list(str)
+        columns to retrieve, if ``None`` all of them
+    lazy : bool
+        if ``True``, return :class:`Record` objects, decoding binary fields only
+        on access
 
     Returns
     -------
@@ -284,8 +621,13 @@ def select_all(session, table_object):
         list of records
 
     """
-    available = session.query(table_object).all()
-    return [deserialize(a) for a in available]
+    if columns is None:
+        columns = [a.key for a in sqlalchemy.inspect(table_object).column_attrs]
+    query = session.query(*[getattr(table_object, c) for c in columns])
+    records = [Record(zip(columns, row)) for row in query]
+    if lazy:
+        return records
+    return [rec.decoded() for rec in records]
 
 
 def update_atime(session, table_object, uids):
@@ -4,16 +4,21 @@ import IPython
 from traitlets.config import loader
 
 from .. import cfg
-from .navigator import c, l, o, t
+from .navigator import c, f, l, m, o, t
 from .utils import compare_dicts
 
 help_vars = f"""t = "{t}" -> query theories
     c = "{c}" -> query cache
-    l = "{l}" -> query logs"""
+    l = "{l}" -> query logs
+    m = "{m}" -> query metrics
+    f = "{f}" -> query failures"""
 help_fncs = """h() - this help
     ext(str) - change external
     g(tbl,id) - getter
-    ls(tbl) - listing table with reduced informations"""
+    ls(tbl) - listing table with reduced informations
+    metrics(sort, query) - listing resources spent per configuration
+    prof(id, stage) - show profile recorded for a log
+    failures(query) - listing failed configurations"""
 
 
 def register_globals(mod, app):
@@ -23,6 +28,8 @@ def register_globals(mod, app):
         "o": o,
         "c": c,
         "l": l,
+        "m": m,
+        "f": f,
         # functions
         "ext": app.change_external,
         "g": app.get,
@@ -30,6 +37,9 @@ def register_globals(mod, app):
         "gbl": app.get_by_log,
         "ls": app.list_all,
         "logs": app.show_full_logs,
+        "metrics": app.list_metrics,
+        "prof": app.profile,
+        "failures": app.list_failures,
         "dfl": app.log_as_dfd,
         # "truncate_logs": app.logs.truncate,
         "diff": app.subtract_tables,
@@ -1,5 +1,7 @@
 import abc
 import datetime as dt
+import pickle
+import pstats
 import textwrap
 
 import numpy as np
@@ -16,8 +18,20 @@ t = "t"
 o = "o"
 c = "c"
 l = "l"
+m = "m"
+f = "f"
 
-table_objects = dict(t=db.Theory, c=db.Cache, l=db.Log)
+table_objects = dict(t=db.Theory, c=db.Cache, l=db.Log, m=db.Metrics, f=db.Failure)
+
+
+class RawStats:
+    """Wrap raw profiling statistics, to load them in :class:`pstats.Stats`."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        """Nothing to do, statistics are already there."""
 
 
 class NavigatorApp(abc.ABC):
@@ -49,6 +63,8 @@ class NavigatorApp(abc.ABC):
             )
         # load logs
         self.logs = tm.TableManager(self.session, db.Log)
+        self.metrics = tm.TableManager(self.session, db.Metrics)
+        self.failures = tm.TableManager(self.session, db.Failure)
 
     def change_external(self, external):
         """
@@ -80,6 +96,10 @@ class NavigatorApp(abc.ABC):
         for tab in self.input_tables:
             if table_abbrev == tab[: len(table_abbrev)]:
                 return tab
+        if table_abbrev == "metrics"[: len(table_abbrev)]:
+            return "metrics"
+        if table_abbrev == "failures"[: len(table_abbrev)]:
+            return "failures"
         raise ValueError(f"Unknown table {table_abbrev}")
 
     def table_manager(self, table):
@@ -100,6 +120,10 @@ class NavigatorApp(abc.ABC):
         tn = self.table_name(table)
         if tn == "logs":
             return self.logs
+        if tn == "metrics":
+            return self.metrics
+        if tn == "failures":
+            return self.failures
         # input table
         return self.input_tables[tn]
 
@@ -146,13 +170,17 @@ class NavigatorApp(abc.ABC):
 
         return self.table_manager(table).get(log[f"{table[0]}_hash"])
 
-    def get_all(self, table):
+    def get_all(self, table, columns=None, lazy=False):
         """Get full table.
 
         Parameters
         ----------
         table : str
             table identifier
+        columns : list(str)
+            columns to retrieve, if ``None`` all of them
+        lazy : bool
+            if ``True``, decode binary fields only on access
 
         Returns
         -------
@@ -160,7 +188,7 @@ class NavigatorApp(abc.ABC):
             the full list of documents in the table
 
         """
-        return self.table_manager(table).all()
+        return self.table_manager(table).all(columns=columns, lazy=lazy)
 
     def list_all(self, table, input_data=None, cut_hash=True):
         """List all elements in a nice table.
@@ -182,7 +210,7 @@ class NavigatorApp(abc.ABC):
         """
         # collect
         if input_data is None:
-            input_data = self.get_all(table)
+            input_data = self.get_all(table, lazy=True)
         data = []
         for el in input_data:
             obj = {"uid": el["uid"]}
@@ -206,6 +234,107 @@ class NavigatorApp(abc.ABC):
             df.set_index("uid", inplace=True)
         return df
 
+    def list_metrics(self, sort="wall", ascending=False, query=None, cut_hash=True):
+        """List resources spent on each configuration.
+
+        Besides the columns of :class:`banana.data.db.Metrics`, the total
+        ``wall`` and ``cpu`` times are available.
+
+        Parameters
+        ----------
+        sort : str or list(str)
+            column(s) to sort on (default: ``"wall"``)
+        ascending : bool
+            sorting order (default: ``False``, i.e. the slowest first)
+        query : str or None
+            if not ``None``, filter on the columns with
+            :meth:`pandas.DataFrame.query` (e.g. ``"ext_wall > 10"``)
+        cut_hash : bool
+            shorten hashes if TRUE
+
+        Returns
+        -------
+        df : pandas.DataFrame
+            metrics
+
+        """
+        df = pd.DataFrame(self.get_all(m))
+        if len(df) == 0:
+            return df
+        df = df.drop(columns=["hash", "ctime", "mtime", "atime"])
+        for kind in ["wall", "cpu"]:
+            df[kind] = df[[f"{stage}_{kind}" for stage in db.stages]].sum(axis=1)
+        if cut_hash:
+            for col in ["t_hash", "o_hash", "log_hash", "cache_hash"]:
+                df[col] = df[col].str[: self.hash_len]
+        df.set_index("uid", inplace=True)
+        if query is not None:
+            df = df.query(query)
+        return df.sort_values(sort, ascending=ascending)
+
+    def list_failures(self, query=None, cut_hash=True):
+        """List the failed configurations, the most recent first.
+
+        Parameters
+        ----------
+        query : str or None
+            if not ``None``, filter on the columns with
+            :meth:`pandas.DataFrame.query` (e.g. ``"exc_type == 'OSError'"``)
+        cut_hash : bool
+            shorten hashes if TRUE
+
+        Returns
+        -------
+        df : pandas.DataFrame
+            failures, without tracebacks (see :meth:`get`)
+
+        """
+        df = pd.DataFrame(self.get_all(f))
+        if len(df) == 0:
+            return df
+        df = df.drop(columns=["hash", "mtime", "atime", "traceback"])
+        if cut_hash:
+            for col in ["t_hash", "o_hash"]:
+                df[col] = df[col].str[: self.hash_len]
+        df.set_index("uid", inplace=True)
+        if query is not None:
+            df = df.query(query)
+        return df.sort_values("ctime", ascending=False)
+
+    def profile(self, doc_id, stage="me", sort="cumulative", amount=20):
+        """Show the profile recorded for a log.
+
+        Parameters
+        ----------
+        doc_id : str or int
+            log identifier, see :meth:`get`
+        stage : str
+            profiled stage, ``"me"`` or ``"ext"`` (default: ``"me"``)
+        sort : str
+            sorting key, see :meth:`pstats.Stats.sort_stats` (default:
+            ``"cumulative"``)
+        amount : int
+            number of entries to print (default: ``20``)
+
+        Returns
+        -------
+        pstats.Stats
+            profiling statistics
+
+        """
+        log = self.get(l, doc_id)
+        record = (
+            self.session.query(db.Profile.stats)
+            .filter(db.Profile.log_hash == log["hash"], db.Profile.stage == stage)
+            .order_by(db.Profile.uid.desc())
+            .first()
+        )
+        if record is None:
+            raise ValueError(f"No '{stage}' profile recorded for log '{doc_id}'")
+        stats = pstats.Stats(RawStats(pickle.loads(record.stats)))
+        stats.sort_stats(sort).print_stats(amount)
+        return stats
+
     def show_full_logs(self, t_fields=None, o_fields=None, keep_hashes=False):
         """Show additional, associated fields in the logs (JOIN).
 
@@ -232,15 +361,15 @@ class NavigatorApp(abc.ABC):
             o_fields = []
 
         # collect external data
-        theories_df = pd.DataFrame(self.get_all(t))
+        theories_df = pd.DataFrame(self.get_all(t, columns=["hash", *t_fields]))
         if len(theories_df) > 0:
             theories = theories_df[["hash"] + t_fields]
             theories = theories.rename(columns={"hash": "theory"})
             theories["theory"] = theories["theory"].apply(lambda h: h[: self.hash_len])
         else:
             theories = theories_df
-        ocards_df = pd.DataFrame(self.get_all(o))
-        if len(theories_df) > 0:
+        ocards_df = pd.DataFrame(self.get_all(o, columns=["hash", *o_fields]))
+        if len(ocards_df) > 0:
             ocards = ocards_df[["hash"] + o_fields]
             ocards = ocards.rename(columns={"hash": "ocard"})
             ocards["ocard"] = ocards["ocard"].apply(lambda h: h[: self.hash_len])
@@ -376,7 +505,7 @@ class NavigatorApp(abc.ABC):
         ref_log = self.get(l, doc_id)
 
         related_logs = []
-        all_logs = self.get_all(l)
+        all_logs = self.get_all(l, lazy=True)
 
         for lg in all_logs:
             if lg["t_hash"] != ref_log["t_hash"]:
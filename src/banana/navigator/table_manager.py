@@ -72,16 +72,29 @@ class TableManager:
             self.session, self.table_object, [rec["uid"] for rec in records]
         )
 
-    def all(self):
+    def all(self, columns=None, lazy=False):
         """Retrieve all entries
 
+        Parameters
+        ----------
+        columns : list(str)
+            columns to retrieve, if ``None`` all of them (``uid`` is always
+            included, in order to update the access time)
+        lazy : bool
+            if ``True``, decode binary fields only on access (see
+            :class:`~banana.data.sql.Record`)
+
         Returns
         -------
         list(dict)
             the retrieved entries
 
         """
-        records = sql.select_all(self.session, self.table_object)
+        if columns is not None and "uid" not in columns:
+            columns = ["uid", *columns]
+        records = sql.select_all(
+            self.session, self.table_object, columns=columns, lazy=lazy
+        )
         self.update_atime(records)
 
         return records
@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+from banana.benchmark import isolation
+
+
+def test_measure():
+    result, wall, cpu, stats = isolation.measure(sum, [1, 2], profile=True)
+    assert result == 3
+    assert wall >= 0.0 and cpu >= 0.0
+    assert isinstance(stats, dict)
+    assert isolation.measure(sum, [1, 2])[3] is None
+
+
+def test_measure_thread():
+    done = threading.Event()
+
+    def spin():
+        while not done.is_set():
+            pass
+
+    busy = threading.Thread(target=spin)
+    busy.start()
+    try:
+        # the spinning thread is not accounted to the measured one
+        _, wall, cpu, _ = isolation.measure(time.sleep, 0.3, thread=True)
+    finally:
+        done.set()
+        busy.join()
+    assert wall >= 0.3
+    assert cpu < 0.1
+
+
+def test_isolated():
+    result, *_, peak = isolation.isolated("me", None, None, sum, [1, 2])
+    assert result == 3
+    assert peak is None or peak > 0
+    with pytest.raises(isolation.IsolationError) as err:
+        isolation.isolated("me", 0.2, None, time.sleep, 10)
+    assert err.value.reason == "timeout"
+    with pytest.raises(isolation.IsolationError) as err:
+        isolation.isolated("ext", None, None, int, "a")
+    assert err.value.reason == "exception"
+    assert err.value.exc_type == "ValueError"
+    assert str(err.value).startswith("ext exception")
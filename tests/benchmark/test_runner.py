@@ -0,0 +1,740 @@
+import collections
+import concurrent.futures
+import itertools
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import types
+
+import pandas as pd
+import pytest
+import sqlalchemy.orm
+
+from banana.benchmark import isolation, queue, runner
+from banana.data import db, dfdict, sql, theories
+
+
+class FakeRunner(runner.BenchmarkRunner):
+    external = "fake"
+    db_base_cls = db.Base
+
+    def __init__(self, db_path):
+        super().__init__()
+        self.banana_cfg = {"paths": {"database": db_path}}
+
+    @staticmethod
+    def load_ocards(_session, ocard_updates):
+        return sql.prepare_records({"n": 1}, ocard_updates)[0]
+
+    flaky = False
+
+    def run_me(self, theory, ocard, pdf):
+        # fail on the first attempt, succeed on the second
+        if self.flaky:
+            self.flaky = False
+            raise OSError("flaky")
+        return {"res": theory["PTO"] * ocard["n"] + len(runner.pdf_name(pdf))}
+
+    def run_external(self, theory, ocard, pdf):
+        return {"res": theory["PTO"] * ocard["n"]}
+
+    def log(self, theory, ocard, pdf, me, ext):
+        # replicas results are keyed by replica number
+        ext = ext.get(0, ext)
+        dfd = dfdict.DFdict()
+        dfd["res"] = pd.DataFrame([dict(me=me["res"], ext=ext["res"])])
+        return dfd
+
+
+class FaultyRunner(FakeRunner):
+    def run_me(self, theory, ocard, pdf):
+        if ocard["n"] == 2:
+            return 1 / 0
+        return super().run_me(theory, ocard, pdf)
+
+    def run_external(self, theory, ocard, pdf):
+        if theory["PTO"] == 1:
+            time.sleep(30)
+        if theory["PTO"] == 2:
+            _leak = b"x" * (self.memory_limit + 100) * 1024**2
+            time.sleep(30)
+        return super().run_external(theory, ocard, pdf)
+
+
+class HungryRunner(FakeRunner):
+    def run_me(self, theory, ocard, pdf):
+        if theory["PTO"] == 1:
+            _leak = b"x" * 200 * 1024**2
+        return super().run_me(theory, ocard, pdf)
+
+
+class PatientRunner(FakeRunner):
+    def run_me(self, theory, ocard, pdf):
+        # wait for the records of the previous theories to be committed
+        if theory["PTO"] == 2:
+            deadline = time.monotonic() + 10.0
+            while len(query(self.banana_cfg["paths"]["database"], db.Log)) == 0:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("records not committed")
+                time.sleep(0.05)
+        return super().run_me(theory, ocard, pdf)
+
+
+class BatchRunner(FakeRunner):
+    calls = []
+
+    def run_me_batch(self, theory, ocards, pdf):
+        self.calls.append(("me", len(ocards)))
+        return super().run_me_batch(theory, ocards, pdf)
+
+    def run_external_batch(self, theory, ocards, pdf):
+        self.calls.append(("ext", len(ocards)))
+        return [self.run_external(theory, ocard, pdf) for ocard in ocards]
+
+
+@pytest.fixture
+def fake_runner(tmp_path):
+    def factory(name="benchmark.db"):
+        return FakeRunner(tmp_path / name)
+
+    yield factory
+
+
+theory_updates = [{"PTO": 0}, {"PTO": 1}, {"PTO": 2}]
+ocard_updates = [{"n": 1}, {"n": 2}]
+pdfs = ["ToyLH", "ToyLH_polarized"]
+
+
+def query(db_path, table):
+    "Collect all rows of a table"
+    session = sqlalchemy.orm.sessionmaker(db.engine(db_path))()
+    rows = sql.select_all(session, table)
+    session.close()
+    return rows
+
+
+def run(bench, **kwargs):
+    bench.run(theory_updates, ocard_updates, pdfs, **kwargs)
+    db_path = bench.banana_cfg["paths"]["database"]
+    return [[r["hash"] for r in query(db_path, table)] for table in (db.Cache, db.Log)]
+
+
+class TestBenchmarkRunner:
+    def test_run(self, fake_runner):
+        cache, logs = run(fake_runner())
+        assert len(cache) == 12
+        assert len(logs) == 12
+        # running again only touches existing records
+        assert run(fake_runner()) == [cache, logs]
+
+    def test_run_parallel(self, fake_runner):
+        serial = run(fake_runner("serial.db"))
+        parallel = run(fake_runner("parallel.db"), workers=3)
+        assert parallel == serial
+
+    def test_run_parallel_interval(self, tmp_path):
+        bench = PatientRunner(tmp_path / "benchmark.db")
+        bench.commit_every = 100
+        bench.commit_interval = 0.1
+        cache, logs = run(bench, workers=2)
+        assert len(cache) == len(logs) == 12
+
+    def test_run_replicas_parallel(self, fake_runner):
+        serial = run(fake_runner("serial.db"), use_replicas=True)
+        bench = fake_runner("parallel.db")
+        bench.replica_workers = 2
+        # the cache hash is computed on the pickled result
+        assert run(bench, use_replicas=True) == serial
+        results = query(bench.banana_cfg["paths"]["database"], db.Cache)
+        assert all(list(r["result"].keys()) == [0] for r in results)
+
+    def test_run_replicas_pool(self, fake_runner, monkeypatch):
+        pools = []
+
+        class Pool(concurrent.futures.ProcessPoolExecutor):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                pools.append(self)
+
+        monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", Pool)
+        bench = fake_runner()
+        bench.replica_workers = 2
+        cache, _ = run(bench, use_replicas=True)
+        # a single pool serves all the configurations
+        assert len(cache) > 1
+        assert len(pools) == 1
+        assert bench.replica_pool is None
+
+    @pytest.mark.parametrize("mode", ["thread", "process"])
+    def test_run_concurrent_external(self, fake_runner, mode):
+        serial = run(fake_runner("serial.db"))
+        bench = fake_runner("concurrent.db")
+        bench.concurrent_external = mode
+        assert run(bench) == serial
+
+    def test_run_concurrent_external_unknown(self, fake_runner):
+        bench = fake_runner()
+        bench.concurrent_external = "fiber"
+        with pytest.raises(ValueError, match="fiber"):
+            run(bench)
+
+    def test_prefetch_external(self, fake_runner, monkeypatch):
+        bench = fake_runner()
+        cache, _ = run(bench)
+        session = bench.db(bench.banana_cfg["paths"]["database"])
+        ts = theories.load(session, theory_updates)
+        os = bench.load_ocards(session, ocard_updates)
+        assert len(bench.prefetch_external(session, ts, os, pdfs)) == 12
+        assert len(bench.prefetch_external(session, ts[:1], os, pdfs)) == 4
+        assert len(bench.prefetch_external(session, ts, os, ["NNPDF40"])) == 0
+        # looking hashes up in chunks does not change the outcome
+        index = bench.prefetch_external(session, ts, os, pdfs)
+        assert bench.prefetch_external(session, ts, os, pdfs, chunk_size=1) == index
+        logged = bench.recorded_configs(session, db.Log, ts[:1], os, pdfs)
+        assert len(logged) == 4
+        assert bench.recorded_configs(session, db.Log, ts[:1], os, pdfs, 1) == logged
+
+        def fail(*_args):
+            raise AssertionError("external should be cached")
+
+        # all hits are resolved from the cache
+        monkeypatch.setattr(FakeRunner, "run_external", fail)
+        assert run(fake_runner())[0] == cache
+
+    @pytest.mark.parametrize("every,interval", [(5, None), (100, 3600.0), (100, 0.0)])
+    def test_run_write_behind(self, fake_runner, every, interval):
+        serial = run(fake_runner("serial.db"))
+        bench = fake_runner("batched.db")
+        bench.commit_every = every
+        bench.commit_interval = interval
+        assert run(bench) == serial
+        # duplicates are skipped
+        assert run(bench) == serial
+
+    def test_run_resume(self, fake_runner, monkeypatch):
+        bench = fake_runner()
+        bench.run(theory_updates[:1], ocard_updates, pdfs)
+        calls = []
+        monkeypatch.setattr(
+            FakeRunner, "run_me", lambda _self, *args: calls.append(args) or {"res": 0}
+        )
+        cache, logs = run(bench, resume=True)
+        assert len(calls) == 8
+        assert all(t["PTO"] != 0 for t, _, _ in calls)
+        assert len(cache) == len(logs) == 12
+        # nothing left
+        run(bench, resume=True)
+        assert len(calls) == 8
+
+    def test_plan(self, fake_runner):
+        bench = fake_runner()
+        report = bench.plan(theory_updates, ocard_updates, pdfs)
+        assert report["configs"] == report["misses"] == 12
+        assert report["estimate"] is None
+        bench.run(theory_updates[:1], ocard_updates, pdfs)
+        report = bench.plan(theory_updates, ocard_updates, pdfs, resume=True)
+        assert report["skipped"] == 4
+        assert report["hits"] == 0
+        assert report["misses"] == 8
+        assert report["costs"]["fake"]["miss"] >= 0.0
+        assert report["estimate"] == 8 * report["costs"]["fake"]["miss"]
+        report = bench.plan(theory_updates, ocard_updates, pdfs)
+        assert report["hits"] == 4
+
+    def test_plan_read_only(self, fake_runner, monkeypatch):
+        bench = fake_runner()
+        db_path = bench.banana_cfg["paths"]["database"]
+        bench.plan(theory_updates, ocard_updates, pdfs)
+        assert not db_path.exists()
+
+        bench.run(theory_updates[:1], ocard_updates[:1], pdfs)
+        binds = []
+
+        def load_ocards(session, ocard_updates):
+            # o-cards may be stored downstream
+            binds.append(session.bind)
+            return sql.prepare_records({"n": 1}, ocard_updates)[0]
+
+        monkeypatch.setattr(FakeRunner, "load_ocards", staticmethod(load_ocards))
+        content = db_path.read_bytes()
+        report = bench.plan(theory_updates, [{"n": 3}], pdfs)
+        assert report["configs"] == 6
+        assert db_path.read_bytes() == content
+        assert binds[0].url.database is None
+
+        # an outdated schema is not migrated, and missing tables are empty
+        with db.engine(db_path).begin() as conn:
+            conn.execute(sqlalchemy.text("DROP INDEX ix_cache_config"))
+            for table in ("metrics", "profiles", "jobs", "failures"):
+                conn.execute(sqlalchemy.text(f"DROP TABLE {table}"))
+        content = db_path.read_bytes()
+        report = bench.plan(theory_updates, ocard_updates, pdfs, failed=True)
+        assert report["configs"] == 0
+        report = bench.plan(theory_updates, ocard_updates, pdfs, resume=True)
+        assert report["skipped"] == 2
+        assert report["hits"] == 0
+        # costs from the logs creation times
+        assert report["costs"]["fake"]["hit"] == report["costs"]["fake"]["miss"]
+        assert db_path.read_bytes() == content
+
+    def test_run_metrics(self, fake_runner):
+        bench = fake_runner()
+        _, logs = run(bench, workers=2)
+        metrics = query(bench.banana_cfg["paths"]["database"], db.Metrics)
+        assert [m["log_hash"] for m in metrics] == logs
+        assert all(m["cache_hash"] is not None for m in metrics)
+        for m in metrics:
+            assert all(m[f"{stage}_wall"] >= 0.0 for stage in db.stages)
+        run(bench)
+        metrics = query(bench.banana_cfg["paths"]["database"], db.Metrics)
+        assert len(metrics) == 24
+        assert all(m["cache_hash"] is None for m in metrics[12:])
+        costs = bench.historical_costs(bench.db(bench.banana_cfg["paths"]["database"]))
+        assert set(costs["fake"].keys()) == {"hit", "miss"}
+
+    @pytest.mark.parametrize("concurrent", [None, "thread"])
+    def test_run_profile(self, fake_runner, monkeypatch, concurrent):
+        class Profile(isolation.cProfile.Profile):
+            active = 0
+
+            def enable(self):
+                # as enforced by Python >= 3.12
+                if Profile.active > 0:
+                    raise ValueError("Another profiling tool is already active")
+                Profile.active += 1
+                super().enable()
+
+            def disable(self):
+                super().disable()
+                Profile.active -= 1
+
+        def slow_external(self, theory, ocard, pdf):
+            # overlap with our program
+            time.sleep(0.05)
+            return {"res": theory["PTO"] * ocard["n"]}
+
+        monkeypatch.setattr(isolation.cProfile, "Profile", Profile)
+        monkeypatch.setattr(FakeRunner, "run_external", slow_external)
+        bench = fake_runner()
+        bench.concurrent_external = concurrent
+        bench.profile_stages = ["me", "ext"]
+        ts, _ = sql.prepare_records(theories.default_card, theory_updates)
+        prefix = ts[0]["hash"][:4]
+        bench.profile_hashes = [prefix]
+        _, logs = run(bench)
+        profiles = query(bench.banana_cfg["paths"]["database"], db.Profile)
+        # 2 o-cards x 2 pdfs x 2 stages
+        assert len(profiles) == 8
+        for p in profiles:
+            assert p["log_hash"] in logs
+            assert p["stage"] in ["me", "ext"]
+            assert p["t_hash"].startswith(prefix)
+            assert isinstance(p["stats"], dict)
+
+    def test_profile_threshold(self, fake_runner):
+        bench = fake_runner()
+        t, o = dict(hash="abc"), dict(hash="def")
+        assert bench.profile_threshold(t, o, "ToyLH") is None
+        bench.profile_stages = ["me"]
+        assert bench.profile_threshold(t, o, "ToyLH") is None
+        bench.profile_rate = 1.0
+        assert bench.profile_threshold(t, o, "ToyLH") == 0.0
+        bench.profile_rate = 0.0
+        bench.profile_duration = 5.0
+        assert bench.profile_threshold(t, o, "ToyLH") == 5.0
+        bench.profile_hashes = ["de"]
+        assert bench.profile_threshold(t, o, "ToyLH") == 0.0
+
+    def test_run_shard(self, fake_runner):
+        serial = fake_runner("serial.db")
+        cache, logs = run(serial)
+        for history in (None, serial.banana_cfg["paths"]["database"]):
+            shards = []
+            for i in range(3):
+                bench = fake_runner(f"shard{i}.db")
+                bench.shard_history = history
+                shards.append(run(bench, shard=(i, 3)))
+                report = bench.plan(theory_updates, ocard_updates, pdfs, shard=(i, 3))
+                # now the shard is completed
+                assert report["hits"] == report["configs"] == len(shards[-1][0])
+                bench.banana_cfg["paths"]["database"].unlink()
+            assert sorted(sum((c for c, _ in shards), [])) == sorted(cache)
+            assert sorted(sum((lg for _, lg in shards), [])) == sorted(logs)
+            assert all(len(c) > 0 for c, _ in shards)
+
+        with pytest.raises(ValueError, match="Shard 3"):
+            fake_runner().run(theory_updates, ocard_updates, pdfs, shard=(3, 3))
+
+    @pytest.mark.parametrize("output", ["progress", "quiet"])
+    def test_run_output(self, fake_runner, capsys, output):
+        serial = run(fake_runner("serial.db"))
+        out = capsys.readouterr().out
+        assert out.count("Computing for") == 12
+        assert "Completed: 12/12" in out
+        bench = fake_runner("quiet.db")
+        bench.output = output
+        assert run(bench, workers=2) == serial
+        out = capsys.readouterr().out
+        assert "Computing for" not in out
+        assert "Completed: 12/12" in out
+        assert "Cached: 0 Computed: 12" in out
+        assert bench.status is None
+
+    def test_run_queue(self, fake_runner):
+        serial = run(fake_runner("serial.db"))
+        bench = fake_runner("queue.db")
+        db_path = bench.banana_cfg["paths"]["database"]
+        # filling the queue is not running anything
+        assert run(bench, queue=True) == [[], []]
+        assert run(bench, queue=True) == [[], []]
+        assert len(query(db_path, db.Job)) == 12
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as pool:
+            done = list(pool.map(work, [db_path] * 2))
+        assert sum(done) == 12
+        cache, logs = [
+            [r["hash"] for r in query(db_path, t)] for t in (db.Cache, db.Log)
+        ]
+        assert sorted(cache) == sorted(serial[0])
+        assert sorted(logs) == sorted(serial[1])
+        assert all(j["status"] == "done" for j in query(db_path, db.Job))
+
+    def test_work_expired_lease(self, fake_runner, monkeypatch):
+        bench = fake_runner()
+        run(bench, queue=True)
+        session = bench.db(bench.banana_cfg["paths"]["database"])
+        # a worker died while running a job, and its lease expires
+        dead = bench.claim_job(session, "dead", lease=0.0)
+        assert bench.work("alive") == 12
+        session.expire_all()
+        assert session.query(db.Job).filter(db.Job.status == "done").count() == 12
+        assert dead.attempts == 2
+
+        # failed jobs are queued again
+        def fail(*_args):
+            raise RuntimeError("boom")
+
+        bench = fake_runner("failed.db")
+        run(bench, queue=True)
+        monkeypatch.setattr(FakeRunner, "run_me", fail)
+        with pytest.raises(RuntimeError, match="boom"):
+            bench.work()
+        assert [
+            j["status"] for j in query(bench.banana_cfg["paths"]["database"], db.Job)
+        ].count("failed") == 1
+        monkeypatch.undo()
+        assert run(bench, queue=True) == [[], []]
+        assert bench.work() == 12
+
+    def test_work_max_attempts(self, fake_runner):
+        bench = fake_runner()
+        bench.max_attempts = 2
+        run(bench, queue=True)
+        session = bench.db(bench.banana_cfg["paths"]["database"])
+        # the job kills its worker, twice
+        first = bench.claim_job(session, "dead", lease=0.0)
+        assert bench.claim_job(session, "dead", lease=0.0).uid == first.uid
+        assert bench.work("alive") == 11
+        session.expire_all()
+        assert first.status == "failed"
+        (failure,) = query(bench.banana_cfg["paths"]["database"], db.Failure)
+        assert failure["reason"] == "crash"
+        assert failure["t_hash"] == first.t_hash
+        # queued again, with a fresh count
+        run(bench, queue=True)
+        session.expire_all()
+        assert (first.status, first.attempts) == ("pending", 0)
+        assert bench.work("alive") == 1
+
+    def test_work_failed_and_taken_over(self, tmp_path, monkeypatch):
+        bench = FaultyRunner(tmp_path / "benchmark.db")
+        bench.continue_on_error = True
+        bench.run(theory_updates[:1], ocard_updates, pdfs, queue=True)
+        # failed jobs are not counted as completed
+        assert bench.work("w") == 2
+
+        bench = FakeRunner(tmp_path / "stolen.db")
+        run(bench, queue=True)
+        session = bench.db(bench.banana_cfg["paths"]["database"])
+
+        def stolen(*_args):
+            # another worker claims the job meanwhile
+            session.query(db.Job).update({db.Job.worker: "thief"})
+            session.commit()
+            return {"res": 0}
+
+        monkeypatch.setattr(FakeRunner, "run_me", stolen)
+        bench.work("w")
+        session.expire_all()
+        assert {j.status for j in session.query(db.Job)} == {"running"}
+
+    def test_heartbeat(self, fake_runner, monkeypatch):
+        bench = fake_runner()
+        run(bench, queue=True)
+        session = bench.db(bench.banana_cfg["paths"]["database"])
+        job = bench.claim_job(session, "w", lease=60.0)
+        commit = sqlalchemy.orm.Session.commit
+        calls = []
+
+        def locked(self):
+            calls.append(1)
+            if len(calls) == 1:
+                raise sqlalchemy.exc.OperationalError("", {}, "database is locked")
+            commit(self)
+
+        monkeypatch.setattr(sqlalchemy.orm.Session, "commit", locked)
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=queue.heartbeat, args=(session.bind, job.uid, "w", 0.3, stop)
+        )
+        heartbeat.start()
+        time.sleep(0.5)
+        assert heartbeat.is_alive()
+        stop.set()
+        heartbeat.join()
+        monkeypatch.undo()
+        session.expire_all()
+        assert len(calls) >= 2
+        assert job.heartbeat is not None
+
+    @pytest.mark.skipif(sys.platform != "linux", reason="peak reset only on Linux")
+    @pytest.mark.parametrize("isolate", [[], ["me"]])
+    def test_run_peak_rss(self, tmp_path, isolate):
+        bench = HungryRunner(tmp_path / "benchmark.db")
+        bench.isolate = isolate
+        run(bench)
+        peaks = [m["peak_rss"] for m in query(tmp_path / "benchmark.db", db.Metrics)]
+        # only the configurations of the hungry theory are charged
+        hungry = [p for p in peaks if p > min(peaks) + 150 * 1024]
+        assert len(hungry) == 4
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_run_isolated(self, tmp_path, workers):
+        bench = FaultyRunner(tmp_path / "benchmark.db")
+        bench.isolate = ["me", "ext"]
+        bench.timeout = 1.0
+        bench.memory_limit = isolation.peak_rss() // 1024 + 100
+        cache, logs = run(bench, workers=workers)
+        assert len(cache) == len(logs) == 2
+        failures = query(bench.banana_cfg["paths"]["database"], db.Failure)
+        reasons = collections.Counter(f["reason"] for f in failures)
+        assert reasons == dict(exception=6, memory=2, timeout=2)
+        exception = [f for f in failures if f["reason"] == "exception"][0]
+        assert exception["stage"] == "me"
+        assert exception["exc_type"] == "ZeroDivisionError"
+        assert "1 / 0" in exception["traceback"]
+
+    def test_run_continue_on_error(self, tmp_path, monkeypatch):
+        bench = FaultyRunner(tmp_path / "benchmark.db")
+        db_path = bench.banana_cfg["paths"]["database"]
+        with pytest.raises(ZeroDivisionError):
+            bench.run(theory_updates[:1], ocard_updates, pdfs)
+        assert len(query(db_path, db.Failure)) == 1
+        bench.continue_on_error = True
+        bench.run(theory_updates[:1], ocard_updates, pdfs)
+        failures = query(db_path, db.Failure)
+        assert len(failures) == 3
+        assert {f["exc_type"] for f in failures} == {"ZeroDivisionError"}
+        assert all("1 / 0" in f["traceback"] for f in failures)
+        assert len(query(db_path, db.Log)) == 2
+        # only run again what failed
+        monkeypatch.setattr(FaultyRunner, "run_me", FakeRunner.run_me)
+        report = bench.plan(theory_updates[:1], ocard_updates, pdfs, failed=True)
+        assert report["configs"] == 2
+        bench.run(theory_updates[:1], ocard_updates, pdfs, failed=True)
+        assert len(query(db_path, db.Log)) == 4
+        report = bench.plan(theory_updates[:1], ocard_updates, pdfs, failed=True)
+        assert report["configs"] == 0
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_run_retries(self, fake_runner, workers):
+        serial = run(fake_runner("serial.db"))
+        bench = fake_runner("flaky.db")
+        bench.retries = 2
+        bench.retry_backoff = 0.0
+        bench.flaky = True
+        assert run(bench, workers=workers) == serial
+        assert len(query(bench.banana_cfg["paths"]["database"], db.Failure)) == 0
+        # only transient errors are retried
+        bench = fake_runner("permanent.db")
+        bench.retries = 2
+        bench.retry_errors = (ValueError,)
+        bench.flaky = True
+        with pytest.raises(OSError, match="flaky"):
+            run(bench, workers=workers)
+
+    @pytest.mark.parametrize(
+        "reason, calls", [("timeout", 1), ("memory", 1), ("exception", 3)]
+    )
+    def test_retrying_limits(self, fake_runner, reason, calls):
+        bench = fake_runner()
+        bench.retries = 2
+        bench.retry_backoff = 0.0
+        attempts = []
+
+        def stage():
+            attempts.append(None)
+            raise isolation.IsolationError("ext", reason, "failed")
+
+        # exceeded limits would be exceeded again
+        with pytest.raises(isolation.IsolationError):
+            bench.retrying(stage)
+        assert len(attempts) == calls
+
+    def test_prepare_pdfs(self, fake_runner, tmp_path, monkeypatch):
+        installed = tmp_path / "share"
+        installed.mkdir()
+        lhapdf = types.ModuleType("lhapdf")
+        lhapdf.paths = lambda: [str(installed)]
+        lhapdf.availablePDFSets = lambda: [p.name for p in installed.iterdir()]
+        lhapdf.mkPDF = lambda name, member: runner.toy.mkPDF("ToyLH", member)
+        monkeypatch.setitem(sys.modules, "lhapdf", lhapdf)
+        mirror = tmp_path / "mirror"
+        (mirror / "NNPDF40").mkdir(parents=True)
+        (mirror / "CT18" / "CT18.info").parent.mkdir()
+        (mirror / "CT18" / "CT18.info").write_text("")
+        with tarfile.open(mirror / "MSHT20.tar.gz", "w:gz") as tar:
+            tar.add(mirror / "CT18", arcname="MSHT20")
+        monkeypatch.setattr(runner, "pdf_cache", collections.OrderedDict())
+        runner.available_pdf_sets.cache_clear()
+
+        bench = fake_runner()
+        bench.pdf_mirror = mirror
+        bench.prepare_pdfs(["ToyLH", "NNPDF40", "CT18", "MSHT20"])
+        assert sorted(p.name for p in installed.iterdir()) == [
+            "CT18",
+            "MSHT20",
+            "NNPDF40",
+        ]
+        assert (installed / "MSHT20" / "CT18.info").is_file()
+        assert ("CT18", False, 0) in runner.pdf_cache
+
+        # archives can only contain the set
+        with tarfile.open(mirror / "evil.tar.gz", "w:gz") as tar:
+            tar.add(mirror / "CT18" / "CT18.info", arcname="../evil.info")
+        with pytest.raises(ValueError, match="Unusable PDF sets: evil"):
+            bench.prepare_pdfs(["evil"])
+        assert not (tmp_path / "evil.info").exists()
+
+        # no mirror and no network
+        def offline(*_args, **_kwargs):
+            raise subprocess.CalledProcessError(1, "lhapdf get")
+
+        monkeypatch.setattr(subprocess, "run", offline)
+        with pytest.raises(ValueError, match="Unusable PDF sets: HERAPDF20"):
+            bench.prepare_pdfs(["NNPDF40", "HERAPDF20"])
+        runner.available_pdf_sets.cache_clear()
+
+    @pytest.mark.parametrize("use_replicas", [False, True])
+    def test_run_batch(self, fake_runner, tmp_path, monkeypatch, use_replicas):
+        serial = run(fake_runner(), use_replicas=use_replicas)
+        monkeypatch.setattr(BatchRunner, "calls", [])
+        bench = BatchRunner(tmp_path / "batch.db")
+        assert bench.batched()
+        assert not fake_runner().batched()
+        cache, logs = run(bench, use_replicas=use_replicas)
+        assert sorted(cache) == sorted(serial[0])
+        assert sorted(logs) == sorted(serial[1])
+        # one call per theory and PDF
+        assert sorted(BatchRunner.calls) == [("ext", 2)] * 6 + [("me", 2)] * 6
+        metrics = query(tmp_path / "batch.db", db.Metrics)
+        assert len(metrics) == 12
+        # cached externals are not computed again
+        BatchRunner.calls.clear()
+        run(BatchRunner(tmp_path / "batch.db"), use_replicas=use_replicas)
+        assert sorted(BatchRunner.calls) == [("me", 2)] * 6
+        parallel = run(BatchRunner(tmp_path / "parallel.db"), workers=2)
+        assert sorted(parallel[1]) == sorted(run(fake_runner("single.db"))[1])
+
+    def test_run_theory_affinity(self, fake_runner):
+        serial = run(fake_runner("serial.db"))
+        bench = fake_runner("pinned.db")
+        bench.theory_affinity = True
+        cache, logs = run(bench, workers=2)
+        assert sorted(cache) == sorted(serial[0])
+        assert sorted(logs) == sorted(serial[1])
+        # whole theories in each shard
+        shards = []
+        for i in range(2):
+            shard = bench.shard_configurations(configs(), (i, 2))
+            shards.append({t["hash"] for t, _, _ in shard})
+            assert len(shard) == 4 * len(shards[-1])
+        assert len(shards[0] | shards[1]) == 3
+        assert len(shards[0] & shards[1]) == 0
+
+    def test_pin_groups(self, fake_runner):
+        groups = fake_runner().config_groups(configs())
+        schedule = runner.BenchmarkRunner.pin_groups(groups, 2)
+        assert sorted(id(g) for _, g in schedule) == sorted(id(g) for g in groups)
+        workers = collections.defaultdict(set)
+        for worker, (t, _, _) in schedule:
+            workers[t["hash"]].add(worker)
+        assert all(len(w) == 1 for w in workers.values())
+        # both workers are busy from the beginning
+        assert {worker for worker, _ in schedule[:2]} == {0, 1}
+
+    def test_claim_job_affinity(self, fake_runner):
+        bench = fake_runner()
+        run(bench, queue=True)
+        session = bench.db(bench.banana_cfg["paths"]["database"])
+        last = session.query(db.Job).order_by(db.Job.uid.desc()).first()
+        job = bench.claim_job(session, "w", 60.0, last.t_hash)
+        assert job.t_hash == last.t_hash
+        assert job.uid != 1
+
+    def test_external_fields(self, fake_runner, monkeypatch):
+        bench = fake_runner()
+        bench.external_theory_fields = ["PTO"]
+        bench.external_ocard_fields = ["n"]
+        commented = [dict(upd, Comments="first") for upd in theory_updates]
+        cache, logs = run(bench)
+        assert len(cache) == 12
+
+        def fail(*_args):
+            raise AssertionError("external should be cached")
+
+        # irrelevant changes do not invalidate the cache
+        monkeypatch.setattr(FakeRunner, "run_external", fail)
+        bench.run(commented, ocard_updates, pdfs)
+        db_path = bench.banana_cfg["paths"]["database"]
+        assert len(query(db_path, db.Cache)) == 12
+        assert len(query(db_path, db.Log)) == 24
+        report = bench.plan(commented, ocard_updates, pdfs)
+        assert report["hits"] == 12
+        # but relevant ones do
+        bench.external_theory_fields = ["PTO", "Comments"]
+        assert bench.plan(commented, ocard_updates, pdfs)["hits"] == 0
+        t, o, pdf = configs()[0]
+        assert runner.projected_hash(t, None) == t["hash"]
+        assert bench.cache_key(t, o, pdf)[0] != t["hash"]
+        # field names are part of the key
+        card = dict(t, PTO=0, IC=0)
+        assert runner.projected_hash(card, ["PTO"]) != runner.projected_hash(
+            card, ["IC"]
+        )
+
+
+def configs():
+    "Expand the configurations of the test run"
+    ts = sql.prepare_records(theories.default_card, theory_updates)[0]
+    os = sql.prepare_records({"n": 1}, ocard_updates)[0]
+    return list(itertools.product(ts, os, pdfs))
+
+
+def work(db_path):
+    "Run a queue worker"
+    return FakeRunner(db_path).work()
+
+
+def test_get_pdf(monkeypatch):
+    monkeypatch.setattr(runner, "pdf_cache", collections.OrderedDict())
+    pdf = runner.get_pdf("ToyLH")
+    assert runner.get_pdf("ToyLH") is pdf
+    assert runner.get_pdf("ToyLH", full_set=True)[0] is not pdf
+    # evict least recently used
+    monkeypatch.setattr(runner, "pdf_cache_budget", 1)
+    pol = runner.get_pdf("ToyLH_polarized")
+    assert list(runner.pdf_cache.keys()) == [("ToyLH_polarized", False, 0)]
+    assert runner.get_pdf("ToyLH_polarized") is pol
+    assert runner.get_pdf("ToyLH") is not pdf
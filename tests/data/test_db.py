@@ -0,0 +1,44 @@
+import sqlalchemy
+
+from banana.data import db
+
+
+def test_migrate(tmp_path):
+    engine = db.engine(tmp_path / "old.db")
+    # a database created by an older version
+    with engine.begin() as conn:
+        conn.execute(
+            sqlalchemy.text(
+                "CREATE TABLE cache (uid INTEGER PRIMARY KEY, hash VARCHAR(64), "
+                + "t_hash VARCHAR(64), o_hash VARCHAR(64), pdf TEXT, result TEXT)"
+            )
+        )
+        conn.execute(
+            sqlalchemy.text(
+                "INSERT INTO cache (uid, hash, t_hash, o_hash, pdf) "
+                + "VALUES (1, 'h', 't', 'o', 'ToyLH')"
+            )
+        )
+    applied = db.migrate(db.Base, engine)
+    assert "column cache.external" in applied
+    assert "column cache.ctime" in applied
+    assert "index ix_cache_config" in applied
+    assert "table logs" in applied
+    inspector = sqlalchemy.inspect(engine)
+    assert {"ix_cache_config"} <= {
+        index["name"] for index in inspector.get_indexes("cache")
+    }
+    with engine.connect() as conn:
+        rows = conn.execute(sqlalchemy.text("SELECT pdf, external FROM cache")).all()
+        assert rows == [("ToyLH", None)]
+        plan = conn.execute(
+            sqlalchemy.text(
+                "EXPLAIN QUERY PLAN SELECT * FROM cache WHERE t_hash = 't' "
+                + "AND o_hash = 'o' AND pdf = 'ToyLH' AND external = 'ext'"
+            )
+        ).all()
+        assert "ix_cache_config" in str(plan)
+    # nothing left to do
+    assert db.migrate(db.Base, engine) == []
+    db.create_db(db.Base, engine)
+    assert db.migrate(db.Base, engine) == []
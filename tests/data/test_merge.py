@@ -0,0 +1,56 @@
+import datetime
+
+import sqlalchemy.orm
+
+from banana.data import db, merge
+
+
+def fill(path, records):
+    engine = db.engine(path)
+    db.create_db(db.Base, engine)
+    with sqlalchemy.orm.Session(bind=engine) as session, session.begin():
+        session.add_all(records)
+    engine.dispose()
+
+
+def test_merge(tmp_path):
+    old = datetime.datetime(2000, 1, 1)
+    new = datetime.datetime(2020, 1, 1)
+    fill(
+        tmp_path / "a.db",
+        [
+            db.Theory(PTO=0, hash="t0", atime=old),
+            db.Theory(PTO=1, hash="t1", atime=new),
+            db.Log(t_hash="t0", o_hash="o0", pdf="ToyLH", hash="l0", log=b"log"),
+        ],
+    )
+    fill(
+        tmp_path / "b.db",
+        [
+            db.Theory(PTO=1, hash="t1", atime=old),
+            db.Theory(PTO=2, hash="t2", atime=old),
+            db.Theory(PTO=0, hash="t0", atime=new),
+        ],
+    )
+
+    target = tmp_path / "target.db"
+    counts = merge.merge(
+        db.Base, target, [tmp_path / "a.db", tmp_path / "b.db"], chunk_size=2
+    )
+    assert counts["theories"] == 5
+    assert counts["logs"] == 1
+
+    engine = db.engine(target)
+    with sqlalchemy.orm.Session(bind=engine) as session:
+        theories = {th.hash: th for th in session.query(db.Theory)}
+        assert sorted(theories) == ["t0", "t1", "t2"]
+        # the newest access time is kept
+        assert theories["t0"].atime == new
+        assert theories["t1"].atime == new
+        assert theories["t2"].PTO == 2
+        assert session.query(db.Log).one().log == b"log"
+
+    # merging again does not duplicate
+    merge.merge(db.Base, target, [tmp_path / "a.db"])
+    with sqlalchemy.orm.Session(bind=engine) as session:
+        assert session.query(db.Theory).count() == 3
@@ -0,0 +1,151 @@
+import pickle
+
+import pandas as pd
+import pytest
+import sqlalchemy
+import sqlalchemy.orm
+
+from banana.data import db, sql, theories
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = db.engine(tmp_path / "test.db")
+    db.create_db(db.Base, engine)
+    with sqlalchemy.orm.Session(bind=engine) as session:
+        yield session
+
+
+def test_insertnew(session):
+    _, df = sql.prepare_records(
+        theories.default_card, [{"PTO": 0}, {"PTO": 1}, {"PTO": 1}]
+    )
+    assert sql.insertnew(session, db.Theory, df) == (2, 1)
+    _, df = sql.prepare_records(theories.default_card, [{"PTO": 0}, {"PTO": 2}])
+    assert sql.insertnew(session, db.Theory, df) == (1, 1)
+    assert sorted(t.PTO for t in session.query(db.Theory)) == [0, 1, 2]
+    assert all(t.ctime is not None for t in session.query(db.Theory))
+    assert sql.insertnew(session, db.Theory, pd.DataFrame()) == (0, 0)
+
+
+@pytest.mark.parametrize("dialects", [sql.dialect_inserts, {}])
+def test_insertnew_error(session, monkeypatch, dialects):
+    monkeypatch.setattr(sql, "dialect_inserts", dialects)
+
+    def locked():
+        raise sqlalchemy.exc.OperationalError("commit", {}, "database is locked")
+
+    monkeypatch.setattr(session, "commit", locked)
+    _, df = sql.prepare_records(theories.default_card, [{"PTO": 0}, {"PTO": 1}])
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        sql.insertnew(session, db.Theory, df)
+    assert session.query(db.Theory).count() == 0
+
+
+def test_insertnew_fallback(session, monkeypatch):
+    monkeypatch.setattr(sql, "dialect_inserts", {})
+    _, df = sql.prepare_records(
+        theories.default_card, [{"PTO": 0}, {"PTO": 1}, {"PTO": 1}]
+    )
+    assert sql.insertnew(session, db.Theory, df, chunk_size=1) == (2, 1)
+    _, df = sql.prepare_records(theories.default_card, [{"PTO": 0}, {"PTO": 2}])
+    assert sql.insertnew(session, db.Theory, df, chunk_size=1) == (1, 1)
+    assert sorted(t.PTO for t in session.query(db.Theory)) == [0, 1, 2]
+
+
+def test_select_by_hash(session, capsys):
+    _, df = sql.prepare_records(
+        theories.default_card, [{"PTO": 0}, {"PTO": 1}, {"PTO": 2}]
+    )
+    sql.insertnew(session, db.Theory, df)
+    hashes = sorted(df["hash"])
+    # shortest unique prefix of the first hash
+    n = next(
+        n for n in range(1, 64) if sum(h.startswith(hashes[0][:n]) for h in hashes) == 1
+    )
+    assert sql.select_by_hash(session, db.Theory, hashes[0][:n])["hash"] == hashes[0]
+    assert sql.select_by_hash(session, db.Theory, hashes[2])["hash"] == hashes[2]
+    with pytest.raises(sql.HashError, match="not unique"):
+        sql.select_by_hash(session, db.Theory, "")
+    out = capsys.readouterr().out
+    assert all(h in out for h in hashes)
+    with pytest.raises(sql.HashError, match="not found"):
+        sql.select_by_hash(session, db.Theory, "z")
+    with pytest.raises(sql.HashError, match="not found"):
+        sql.select_by_hash(session, db.Theory, hashes[0] + "0")
+
+
+def test_prefix_range_uses_index(session):
+    query = session.query(db.Theory.hash).filter(
+        sql.prefix_range(db.Theory.hash, "abc")
+    )
+    statement = query.statement.compile(compile_kwargs={"literal_binds": True})
+    plan = session.execute(sqlalchemy.text(f"EXPLAIN QUERY PLAN {statement}")).all()
+    assert any("USING COVERING INDEX" in row[-1] for row in plan)
+
+
+def test_select_by_position(session):
+    _, df = sql.prepare_records(
+        theories.default_card, [{"PTO": 0}, {"PTO": 1}, {"PTO": 2}]
+    )
+    sql.insertnew(session, db.Theory, df)
+    records = session.query(db.Theory).order_by(db.Theory.uid).all()
+    for pos in range(-3, 3):
+        assert (
+            sql.select_by_position(session, db.Theory, pos)["uid"] == records[pos].uid
+        )
+    for pos in (3, -4):
+        with pytest.raises(IndexError):
+            sql.select_by_position(session, db.Theory, pos)
+
+
+def test_select_all(session, monkeypatch):
+    _, df = sql.prepare_records(theories.default_card, [{"PTO": 0}, {"PTO": 1}])
+    sql.insertnew(session, db.Theory, df)
+    session.add(db.Log(hash="h", t_hash="t", log=pickle.dumps({"a": [1, 2]})))
+    session.commit()
+
+    recs = sql.select_all(session, db.Theory, columns=["uid", "PTO"])
+    assert [rec["PTO"] for rec in recs] == [0, 1]
+    assert all(set(rec) == {"uid", "PTO"} for rec in recs)
+    (full,) = sql.select_all(session, db.Log)
+    assert full["log"] == {"a": [1, 2]}
+
+    calls = []
+    monkeypatch.setattr(sql, "decode", lambda el: calls.append(el) or "decoded")
+    (rec,) = sql.select_all(session, db.Log, lazy=True)
+    assert isinstance(rec, dict)
+    assert rec["t_hash"] == "t" and not calls
+    assert rec["log"] == "decoded" and rec.get("log") == "decoded"
+    assert len(calls) == 1
+    assert rec.decoded() == dict(full, log="decoded")
+
+
+def test_write_behind(session, monkeypatch):
+    writer = sql.WriteBehind(session, every=10, interval=60.0)
+    assert writer.remaining() is None
+    writer.add(db.Log, dict(hash="a"))
+    assert 0 < writer.remaining() <= 60.0
+    writer.maybe_flush()
+    assert session.query(db.Log).count() == 0
+    # flushed ahead of a long computation
+    writer.maybe_flush(ahead=3600.0)
+    assert session.query(db.Log).count() == 1
+    assert writer.remaining() is None
+
+    # records are kept on failure
+    def locked():
+        raise sqlalchemy.exc.OperationalError("commit", {}, "database is locked")
+
+    writer.add(db.Log, dict(hash="b"))
+    writer.add(db.Log, dict(hash="a"))
+    monkeypatch.setattr(session, "commit", locked)
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        writer.flush()
+    assert len(writer.pending_records(db.Log)) == 2
+    monkeypatch.undo()
+    duplicates = []
+    writer.pending[1] = (*writer.pending[1][:3], lambda: duplicates.append(1))
+    writer.flush()
+    assert writer.pending == [] and duplicates == [1]
+    assert sorted(h for (h,) in session.query(db.Log.hash)) == ["a", "b"]
@@ -1,3 +1,5 @@
+import cProfile
+import datetime
 import pathlib
 import pickle
 
@@ -240,6 +242,80 @@ class TestNavigatorAppSchemeDependent:
         assert logs["process"][17] == 0
         assert logs["pdf"][17] == "NNPDF"
 
+    def test_list_metrics(self, benchsession, benchnav):
+        db.Metrics.__table__.create(benchsession.bind)
+        assert len(benchnav.list_metrics()) == 0
+
+        with benchsession.begin():
+            for uid, me in [(1, 1.0), (2, 3.0), (3, 2.0)]:
+                newm = db.Metrics(
+                    uid=uid,
+                    t_hash="abcdefgh",
+                    o_hash="def",
+                    log_hash=f"{uid}23456789",
+                    hash=str(uid),
+                    me_wall=me,
+                    ext_wall=1.0,
+                )
+                benchsession.add(newm)
+
+        df = benchnav.list_metrics()
+        assert list(df.index) == [2, 3, 1]
+        assert df["wall"][2] == 4.0
+        assert df["t_hash"][1] == "abcdef"
+        df = benchnav.list_metrics("me_wall", ascending=True, query="me_wall > 1")
+        assert list(df.index) == [3, 2]
+
+    def test_list_failures(self, benchsession, benchnav):
+        db.Failure.__table__.create(benchsession.bind)
+        assert len(benchnav.list_failures()) == 0
+
+        with benchsession.begin():
+            for uid, exc_type in [(1, "OSError"), (2, "ValueError"), (3, "OSError")]:
+                newf = db.Failure(
+                    uid=uid,
+                    t_hash="abcdefgh",
+                    o_hash="def",
+                    pdf="NNPDF",
+                    hash=str(uid),
+                    reason="exception",
+                    exc_type=exc_type,
+                    traceback="Traceback ...",
+                    ctime=datetime.datetime(2020, 1, uid),
+                )
+                benchsession.add(newf)
+
+        df = benchnav.list_failures()
+        assert list(df.index) == [3, 2, 1]
+        assert "traceback" not in df.columns
+        assert df["t_hash"][1] == "abcdef"
+        df = benchnav.list_failures(query="exc_type == 'OSError'")
+        assert list(df.index) == [3, 1]
+        assert benchnav.get("f", 2)["traceback"] == "Traceback ..."
+
+    def test_profile(self, benchsession, benchnav, capsys):
+        db.Profile.__table__.create(benchsession.bind)
+        profiler = cProfile.Profile()
+        profiler.runcall(sorted, [3, 1, 2])
+        profiler.create_stats()
+        with benchsession.begin():
+            newl = Log(uid=17, t_hash="abc", o_hash="def", pdf="NNPDF", hash="1234")
+            benchsession.add(newl)
+            newp = db.Profile(
+                uid=1,
+                log_hash="1234",
+                stage="me",
+                hash="5678",
+                stats=pickle.dumps(profiler.stats),
+            )
+            benchsession.add(newp)
+
+        stats = benchnav.profile(17)
+        assert stats.total_calls > 0
+        assert "sorted" in capsys.readouterr().out
+        with pytest.raises(ValueError, match="No 'ext' profile"):
+            benchnav.profile(17, "ext")
+
     def test_get_by_log(self, benchsession, benchnav):
         with benchsession.begin():
             newt = Theory(uid=42, PTO=31, hash="abc")
@@ -106,6 +106,9 @@ class TestTableManager:
         for i in range(10):
             assert recs[i] != millennium
 
+        recs = tabman.all(columns=["hash"])
+        assert all(set(rec) == {"uid", "hash"} for rec in recs)
+
     def test_get(self, dbsession, tab_ciao):
         tabman = tm.TableManager(dbsession, tab_ciao)
         assert_len = make_asserter(dbsession, tab_ciao, builtins.len)